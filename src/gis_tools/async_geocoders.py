@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+
+from . import geocoders, reverse_geocoders
+from .geocoders import (
+    GeocoderError,
+    _here_params,
+    _here_parse,
+    _yandex_params,
+    _yandex_parse,
+    clean_address,
+    normalize_address,
+)
+from .geocoding_cache import lookup, store
+from .http_utils import AsyncHttpClient
+from .reverse_geocoders import (
+    _here_revgeocode_params,
+    _here_revgeocode_parse,
+    round_point,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGeocoder:
+    """Асинхронный клиент HERE и YANDEX. Все запросы идут через один http_utils.AsyncHttpClient
+    (ограничение частоты по хостам и повторы при 429), количество одновременных запросов
+    ограничено семафором. Кэш общий с синхронными функциями
+
+    Пример:
+        async with AsyncGeocoder(concurrency=20) as geocoder:
+            async for i, point in geocoder.stream(addresses):
+                ...
+    """
+
+    def __init__(
+        self, concurrency=10, rate_limit=None, burst=None, tries=5, backoff=1.0
+    ):
+        """
+        Args:
+            concurrency (int, optional): максимум одновременных запросов
+            rate_limit (float, optional): максимум запросов в секунду к каждому хосту, None - без ограничения
+            burst (int, optional): размер корзины токенов, по умолчанию равен rate_limit
+            tries (int, optional): количество попыток при ответе 429
+            backoff (float, optional): начальная пауза между попытками в секундах
+        """
+        self.concurrency = concurrency
+        self.client = AsyncHttpClient(
+            rate_limit=rate_limit,
+            burst=burst,
+            tries=tries,
+            backoff=backoff,
+            pool_size=concurrency,
+            per_host=True,
+        )
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        await self.client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.__aexit__(*exc_info)
+
+    async def get_json(self, url, params):
+        async with self._semaphore:
+            _, content = await self.client.get(url, params=params)
+        return json.loads(content)
+
+    async def _cached(self, provider, key, request):
+        found, result = await asyncio.to_thread(lookup, provider, key)
+        if found:
+            return result
+        try:
+            result = await request()
+        except GeocoderError:
+            logger.exception(f"({provider}) Error")
+            return None
+        await asyncio.to_thread(store, provider, key, result)
+        return result
+
+    async def here(self, search_string, **kwargs):
+        """Асинхронный аналог geocoders.here
+
+        Args:
+            search_string (str): адрес
+            **kwargs: return_attrs, additional_params - как в geocoders.here
+        """
+
+        search_string = normalize_address(search_string)
+        key = geocoders.here.cache_key(search_string, **kwargs)
+
+        async def request():
+            params = _here_params(search_string, kwargs.get("additional_params"))
+            try:
+                data = await self.get_json(geocoders.HERE_GEOCODE_URL, params)
+            except Exception as e:
+                raise GeocoderError("(HERE) Request error") from e
+            return _here_parse(data, kwargs.get("return_attrs", False))
+
+        return await self._cached("here", key, request)
+
+    async def yandex(self, search_string):
+        """Асинхронный аналог geocoders.yandex"""
+        search_string = clean_address(search_string)
+        key = geocoders.yandex.cache_key(search_string)
+
+        async def request():
+            params = _yandex_params(search_string)
+            try:
+                data = await self.get_json(geocoders.YANDEX_GEOCODE_URL, params)
+            except Exception as e:
+                raise GeocoderError("(YANDEX) Request error") from e
+            return _yandex_parse(data, search_string)
+
+        return await self._cached("yandex", key, request)
+
+    async def here_address_by_point(self, pt):
+        """Асинхронный аналог reverse_geocoders.here_address_by_point"""
+        pt = round_point(pt)
+        key = reverse_geocoders.here_address_by_point.cache_key(pt)
+
+        async def request():
+            params = _here_revgeocode_params(pt)
+            try:
+                data = await self.get_json(
+                    reverse_geocoders.HERE_REVGEOCODE_URL, params
+                )
+            except Exception as e:
+                raise GeocoderError("(HERE) Reverse request error") from e
+            return _here_revgeocode_parse(data)
+
+        return await self._cached("here_address_by_point", key, request)
+
+    async def stream(self, inputs, provider="here", **kwargs):
+        """Геокодирует поток адресов (или точек для here_address_by_point),
+        держа в работе не больше 2 * concurrency задач
+
+        Args:
+            inputs (Iterable): адреса или точки
+            provider (str, optional): here, yandex или here_address_by_point
+            **kwargs: аргументы метода провайдера
+
+        Yields:
+            tuple(int, object): индекс входного значения и результат, в порядке готовности
+        """
+        method = getattr(self, provider)
+
+        async def run(i, value):
+            return i, await method(value, **kwargs)
+
+        pending = set()
+        try:
+            for i, value in enumerate(inputs):
+                pending.add(asyncio.ensure_future(run(i, value)))
+                if len(pending) >= 2 * self.concurrency:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        yield task.result()
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
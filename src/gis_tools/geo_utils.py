@@ -1,103 +1,257 @@
+import asyncio
 import logging
-import os
 import shutil
-from itertools import product
-from math import floor
+import tempfile
+import threading
+from contextlib import contextmanager
+from math import atan, degrees, floor, log, pi, radians, sin, sinh
 from pathlib import Path
 
 import geopandas as gpd
 import numpy as np
 import pyproj
-from shapely import wkb
-from shapely.geometry import box
+import shapely
 
+from .http_utils import AsyncHttpClient, HttpClient, batch_client
 from .threads_utils import pool_execute
+from .tile_store import TileStore, handler_key, tile_key
+from .tile_sources import CallableSource, as_tile_source
+from .tile_writers import GeoTiffWriter
 
 logger = logging.getLogger(__name__)
+DEFAULT_TILES_FOLDER = Path.home() / ".gis_tools" / "tiles"
 
 
 class GeoTiffer:
     """
-    Данный класс позволяет быстро получить геопривязанный .tif из кучи разных тайлов
+    Данный класс позволяет быстро получить геопривязанный .tif из кучи разных тайлов.
+    Скачанные тайлы сохраняются в хранилище (см. tile_store.TileStore) и сразу передаются
+    в writer, который собирает результат (см. tile_writers)
     """
 
-    def __init__(self, grid_data, download_handler, download_options={}):
+    def __init__(
+        self,
+        grid_data,
+        download_handler,
+        download_options={},
+        workers=100,
+        tiles_folder=None,
+        max_age=None,
+        writer=None,
+        rate_limit=None,
+        retries=0,
+        backoff=1.0,
+        store_key=None,
+    ):
         """
         Args:
             grid_data (str|pathlib.Path|geopandas.GeoSeries|geopadnas.GeoDataFrame): Датасет с геометрией тайлов (или путь к нему)
-            download_handler (function): Функция, которая выполняет скачивание тайлов. На вход должна принимать координаты тайла (bounds) и kwargs. Должна возвращать bytes или None
-            download_options (dict, optional): Аргументы для download_handler
+            download_handler (function|tile_sources.TileSource): Источник тайлов (см. tile_sources). Функция должна принимать координаты тайла (bounds) и kwargs и возвращать bytes или None. Функция может быть корутиной, в аргумент session (если он есть) передается общая сессия
+            download_options (dict, optional): Аргументы для download_handler-функции
+            workers (int|str|AdaptiveConcurrency, optional): Количество потоков скачивания. "adaptive" - подбирается по задержкам и ошибкам (в том числе 429) сервера тайлов, см. threads_utils.pool_iter
+            tiles_folder (str|pathlib.Path, optional): Папка хранилища тайлов. Без incremental в ней создается временная папка задачи, которая удаляется после сборки. По умолчанию - DEFAULT_TILES_FOLDER для incremental и системная временная папка без него
+            max_age (float, optional): Время жизни скачанного тайла в секундах для инкрементального режима. None - бессрочно
+            writer (tile_writers.TileWriter, optional): Запись результата. По умолчанию GeoTiffWriter - мозаика через VRT. Для очень больших результатов - WindowedGeoTiffWriter, для раздачи по HTTP - COGWriter, для slippy-тайлов из tiles_over_shape - MBTilesWriter
+            rate_limit (float, optional): Максимум запросов в секунду к каждому хосту, None - без ограничения
+            retries (int, optional): Количество повторов скачивания тайла при ошибке (ответы 429 повторяются отдельно, см. http_utils.HttpClient)
+            backoff (float, optional): Начальная пауза между повторами в секундах
+            store_key (str, optional): Имя хранилища тайлов инкрементального режима. По умолчанию - хэш обработчика
+                и его аргументов (см. tile_store.handler_key). Обязателен, если обработчик нельзя хэшировать
+                (например, в его аргументах сессия или соединение) и если обработчики отличаются
+                только изменяемым состоянием замыкания
         """
-        self.script_folder = Path(__file__).resolve().parent
-        self.tiles_folder = self.script_folder / "_tiles"
-        self.geo_folder = self.tiles_folder / "_georeferenced"
-
+        if isinstance(grid_data, (str, Path)):
+            grid_data = gpd.read_file(str(grid_data))
         self.grid = _geo_input_handler(grid_data)
+        # все колонки сетки (например, x, y, z от tiles_over_shape) доступны writer'у
+        self.grid_data = gpd.GeoDataFrame(
+            grid_data if isinstance(grid_data, gpd.GeoDataFrame) else None,
+            geometry=self.grid,
+        )
         self.crs_code = str(self.grid.crs)
-        self.download_tile = download_handler
+        self.source = as_tile_source(download_handler, download_options)
+        if (
+            rate_limit
+            and isinstance(self.source, CallableSource)
+            and not self.source.uses_client
+        ):
+            logger.warning(
+                "rate_limit и повторы при 429 не действуют: download_handler не принимает session "
+                "или является корутиной. Используйте TileSource (см. tile_sources)"
+            )
+        # атрибуты тайлов для источника (x, y, z и т.п.) - массивы колонок, тайл ищется по позиции в сетке
+        self.tiles_attrs = {
+            column: self.grid_data[column].to_numpy()
+            for column in self.grid_data.columns
+            if column != self.grid_data.geometry.name
+        }
+        self.workers = workers
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.client = None
+        self._loop = None
+        self.tiles_folder = Path(tiles_folder) if tiles_folder else None
+        self.max_age = max_age
+        self.writer = writer or GeoTiffWriter()
+        self.download_handler = download_handler
         self.download_options = download_options
+        self.store_key = store_key
+        self.store = None
+
+    @property
+    def store_folder(self):
+        """Хранилище тайлов обработчика с его аргументами для инкрементального режима"""
+        key = self.store_key or handler_key(
+            self.download_handler, self.download_options
+        )
+        return (self.tiles_folder or DEFAULT_TILES_FOLDER) / key
 
-    def georeferencing_tile(self, tile_path, tile_geom):
-        from osgeo import gdal
-
+    def download_tile(self, tile_index, tile_geom):
+        """Скачивает тайл через источник. Асинхронный источник выполняется в общем цикле событий задачи"""
         bounds = tile_geom.bounds
-        bounds = [bounds[0], bounds[3], bounds[2], bounds[1]]
-        gdal.Translate(
-            str(self.geo_folder / (tile_path.stem + ".tif")),
-            str(tile_path),
-            outputSRS=self.crs_code,
-            outputBounds=bounds,
+        position = self.grid_data.index.get_loc(tile_index)
+        tile = {column: values[position] for column, values in self.tiles_attrs.items()}
+        if self.source.is_async:
+            return asyncio.run_coroutine_threadsafe(
+                self.source.fetch_async(bounds, tile, self.client), self._loop
+            ).result()
+        return self.source.fetch(bounds, tile, self.client)
+
+    @contextmanager
+    def open_client(self):
+        """Общий для всех потоков HTTP-клиент задачи: пул соединений, повторы при 429 и ограничение частоты
+        запросов по хостам. Для асинхронного источника - aiohttp-клиент в отдельном потоке с циклом событий
+
+        Yields:
+            int|AdaptiveConcurrency: workers для пула скачивания
+        """
+        client_class = AsyncHttpClient if self.source.is_async else HttpClient
+        workers, self.client = batch_client(
+            self.workers,
+            self.rate_limit,
+            tries=5,
+            backoff=self.backoff,
+            per_host=True,
+            client_class=client_class,
         )
+        if not self.source.is_async:
+            try:
+                yield workers
+            finally:
+                self.client.session.close()
+                self.client = None
+            return
+        self._loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self.client.__aenter__(), self._loop
+            ).result()
+            try:
+                yield workers
+            finally:
+                asyncio.run_coroutine_threadsafe(
+                    self.client.__aexit__(None, None, None), self._loop
+                ).result()
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            thread.join()
+            self._loop.close()
+            self._loop = None
+            self.client = None
 
     def get_tile(self, tile_index, tile_geom):
+        key = tile_key(tile_geom.bounds)
+        # ошибки скачивания логирует пул, они же уменьшают лимит потоков при workers="adaptive".
+        # Тайл, который не принял writer (например, HTML-страница ошибки вместо изображения),
+        # тоже помечается упавшим, чтобы следующий запуск скачал его заново
         try:
-            tile_bytes = self.download_tile(tile_geom.bounds, **self.download_options)
-        except Exception:
-            logger.exception(f"Index: {tile_index}, Bounds: {tile_geom.bounds}")
-        else:
+            tile_bytes = self.download_tile(tile_index, tile_geom)
+            self.store.put(key, tile_index, tile_bytes)
             if tile_bytes:
-                tile_path = self.tiles_folder / ("%05d.png" % tile_index)
-                with open(tile_path, "wb") as file:
-                    file.write(tile_bytes)
-                self.georeferencing_tile(tile_path, tile_geom)
-            else:
+                self.writer.write(tile_index, tile_geom, self.store.path(key))
+        except Exception as e:
+            self.store.fail(key, tile_index, e)
+            raise
+        if not tile_bytes:
+            logger.warning(f"No data (Index: {tile_index}, Bounds: {tile_geom.bounds})")
+
+    def write_stored_tiles(self):
+        """Передает в writer уже скачанные тайлы текущей сетки. В хранилище могут быть и тайлы прошлых запусков.
+        Тайлы, которые writer не принял, помечаются упавшими и скачиваются заново
+
+        Returns:
+            list: пары (индекс, геометрия) тайлов, которые нужно скачать
+        """
+        done, missing = self.store.split(self.grid.items())
+        for tile_index, tile_geom in done:
+            key = tile_key(tile_geom.bounds)
+            try:
+                self.writer.write(tile_index, tile_geom, self.store.path(key))
+            except Exception as e:
                 logger.warning(
-                    f"No data (Index: {tile_index}, Bounds: {tile_geom.bounds})"
+                    f"Stored tile rejected by writer, downloading again "
+                    f"(Index: {tile_index}): {e!r}"
                 )
-
-    def merge_tiles(self, output_path):
-        mosaic_path = self.script_folder / "mosaic.vrt"
-        inputlist_path = self.script_folder / "inputlist.txt"
-        tiles_glob = self.geo_folder.glob("*.tif")
-        with open(inputlist_path, "w", encoding="utf-8") as file:
-            for tile in tiles_glob:
-                file.write(str(tile))
-                file.write("\n")
-        os.system(
-            f'gdalbuildvrt -input_file_list "{str(inputlist_path)}" "{str(mosaic_path)}"'
-        )
-        os.system(
-            f'gdal_translate -of GTiff -co "COMPRESS=JPEG" -co "TILED=YES" "{str(mosaic_path)}" "{str(output_path)}"'
-        )
-        mosaic_path.unlink()
-        inputlist_path.unlink()
+                self.store.fail(key, tile_index, e)
+                missing.append((tile_index, tile_geom))
+        return missing
 
     def delete_tiles(self):
-        if self.tiles_folder.exists():
-            shutil.rmtree(self.tiles_folder)
+        """Удаляет хранилище тайлов инкрементального режима"""
+        if self.store_folder.exists():
+            shutil.rmtree(self.store_folder)
 
-    def make_geotiff(self, output_path):
+    def make_geotiff(self, output_path, incremental=False):
         """Производит полный цикл обработки тайлов
 
         Args:
             output_path (pathlib.Path): Путь для сохранения результата
+            incremental (bool, optional): Если True, хранилище тайлов сохраняется между запусками
+                и скачиваются только новые, устаревшие (см. max_age) и упавшие в прошлый раз тайлы.
+                Так прерванная задача или задача с расширенной сеткой докачивает только разницу.
+                Если False, тайлы скачиваются во временную папку задачи и удаляются после сборки,
+                поэтому одновременные задачи друг другу не мешают
         """
-        self.delete_tiles()
-        self.tiles_folder.mkdir(exist_ok=True)
-        self.geo_folder.mkdir(exist_ok=True)
-        pool_execute(self.get_tile, self.grid.to_dict().items())
-        self.merge_tiles(output_path)
-        self.delete_tiles()
+        if incremental:
+            store_folder = self.store_folder
+        else:
+            if self.tiles_folder:
+                self.tiles_folder.mkdir(parents=True, exist_ok=True)
+            store_folder = Path(
+                tempfile.mkdtemp(prefix="gis_tools_tiles_", dir=self.tiles_folder)
+            )
+        self.store = TileStore(store_folder, self.max_age)
+        try:
+            self.writer.open(output_path, self.grid_data)
+            try:
+                tiles = self.write_stored_tiles()
+                logger.info(
+                    f"{len(self.grid) - len(tiles)} tiles from store, {len(tiles)} to download"
+                )
+                with self.open_client() as workers:
+                    pool_execute(
+                        self.get_tile,
+                        tiles,
+                        workers=workers,
+                        errors="skip",
+                        retries=self.retries,
+                        backoff=self.backoff,
+                    )
+                logger.info(
+                    f"Tiles: {self.store.report(tile_key(g.bounds) for g in self.grid)}"
+                )
+            except BaseException:
+                self.writer.abort()
+                raise
+            self.writer.close()
+        finally:
+            self.store.close()
+            self.store = None
+            if not incremental:
+                shutil.rmtree(store_folder, ignore_errors=True)
 
     @staticmethod
     def download_geotiff(output_path, grid_data, download_handler, **download_options):
@@ -128,24 +282,33 @@ def convert_to_local_csr(geom):
     return geom.to_crs(utm)
 
 
-def _tiles_filtering_by_geometry(tiles, geom, fill_area_filter_factor):
-    if isinstance(fill_area_filter_factor, float) and 1 > fill_area_filter_factor > 0:
-        int_area = tiles.intersection(geom).area
-        area_ratio = int_area / tiles.area
-        return tiles[area_ratio > fill_area_filter_factor]
-    else:
-        # это хоть и аналогично fill_area_filter_factor == 0 но работает значительно быстрее
-        return tiles[tiles.intersects(geom)]
-
-
 def _tiles_filtering_by_series(tiles, extent_geoseries, fill_area_filter_factor):
     assert tiles.crs == extent_geoseries.crs
-    filtered_tiles = tiles.iloc[0:0]  # копируем тип, но не копируем данные
-    for i, geom in enumerate(extent_geoseries):
-        ft = _tiles_filtering_by_geometry(tiles, geom, fill_area_filter_factor)
-        con = gpd.pd.concat([filtered_tiles, ft])
-        filtered_tiles = gpd.GeoDataFrame(con)
-    return geopandas_drop_duplicates(filtered_tiles)
+    extents = extent_geoseries.values
+    # один запрос к STRtree тайлов возвращает все пары (экстент, тайл), которые пересекаются
+    extent_idx, tile_idx = tiles.sindex.query(extents, predicate="intersects")
+    tile_idx = _filter_pairs_by_area(
+        tiles.geometry.values,
+        extents,
+        extent_idx,
+        tile_idx,
+        fill_area_filter_factor,
+    )
+    return tiles.iloc[tile_idx]
+
+
+def _filter_pairs_by_area(tile_geoms, extents, extent_idx, tile_idx, factor):
+    """Отсекает пары (экстент, тайл), в которых тайл покрыт экстентом меньше чем на factor
+
+    Returns:
+        numpy.ndarray: отсортированные уникальные индексы оставшихся тайлов
+    """
+    if isinstance(factor, float) and 1 > factor > 0:
+        tile_geoms = tile_geoms[tile_idx]
+        int_area = shapely.area(shapely.intersection(tile_geoms, extents[extent_idx]))
+        area_ratio = int_area / shapely.area(tile_geoms)
+        tile_idx = tile_idx[area_ratio > factor]
+    return np.unique(tile_idx)
 
 
 def _geo_input_handler(geodata, crs=None):
@@ -165,6 +328,16 @@ def _geo_input_handler(geodata, crs=None):
     return geoseries
 
 
+def _grid_bounds(xs, ys, x_delta, y_delta):
+    """Собирает массив границ тайлов (minx, miny, maxx, maxy) для всех пар xs*ys.
+    Порядок строк такой же, как у itertools.product(xs, ys)
+    """
+    minx, miny = np.meshgrid(xs, ys, indexing="ij")
+    minx = minx.ravel()
+    miny = miny.ravel()
+    return np.column_stack([minx, miny, minx + x_delta, miny + y_delta])
+
+
 def grid_over_shape(
     geodata,
     crs_code,
@@ -176,6 +349,7 @@ def grid_over_shape(
     y_factor=None,
     filter_by_shape=True,
     fill_area_filter_factor=0.0,
+    bounds_only=False,
 ):
     """Создает сетку тайлов поверх входных экстентов
 
@@ -190,9 +364,10 @@ def grid_over_shape(
         y_factor (float, optional): Шаг по Y будет равен этому значению умноженному на шаг X. Нельзя использовать одновременно с x_factor!
         filter_by_shape (bool, optional): если True, тайлы bbox'а, которые не пересекаются c экстентом, будут отсечены в противном случае тайлы будут распределены по всему bbox
         fill_area_filter_factor (float, optional): коэффициент площади, меньше которой тайл отсекается при filter_by_shape. Например, при коэффициенте равном 0.25, тайл, который покрывает меньше 25% экстента, будет отсечен
+        bounds_only (bool, optional): если True, вместо геометрий возвращается массив границ тайлов (minx, miny, maxx, maxy). Без filter_by_shape геометрии при этом вообще не создаются
 
     Returns:
-        geopandas.GeoSeries: серия с тайлами
+        geopandas.GeoSeries|numpy.ndarray: серия с тайлами или массив границ формы (N, 4)
     """
     geoseries = _geo_input_handler(geodata, crs_code)
     x1, y1 = geoseries.bounds.min()[["minx", "miny"]]
@@ -220,68 +395,197 @@ def grid_over_shape(
         y_delta = x_delta * y_factor
         ys = np.arange(y1, y2, y_delta)
 
-    df = gpd.pd.DataFrame(product(xs, ys), columns=["minx", "miny"])
-    df["maxx"] = df["minx"] + x_delta
-    df["maxy"] = df["miny"] + y_delta
-    df["geometry"] = df.apply(lambda x: box(**x.to_dict()), axis=1)
-    tiles = gpd.GeoSeries(df["geometry"], crs=crs_code)
+    bounds = _grid_bounds(xs, ys, x_delta, y_delta)
+    if bounds_only and not filter_by_shape:
+        return bounds
+    tiles = gpd.GeoSeries(shapely.box(*bounds.T), crs=crs_code)
     if filter_by_shape:
         tiles = _tiles_filtering_by_series(tiles, geoseries, fill_area_filter_factor)
+    if bounds_only:
+        return shapely.bounds(tiles.values)
     return tiles
 
 
+# константы mercantile: номера тайлов должны совпадать с mercantile.tiles
+_MERCATOR_MAX_LAT = 85.051129
+_TILE_EPSILON = 1e-14
+_LL_EPSILON = 1e-11
+
+
+def _lnglat_to_tile(lng, lat, zoom):
+    """Номер (x, y) тайла, содержащего точку. Повторяет mercantile.tile"""
+    x = lng / 360.0 + 0.5
+    sinlat = sin(radians(lat))
+    y = 0.5 - 0.25 * log((1.0 + sinlat) / (1.0 - sinlat)) / pi
+    z2 = 2.0**zoom
+    return tuple(
+        0 if v <= 0 else int(z2 - 1) if v >= 1 else int(floor((v + _TILE_EPSILON) * z2))
+        for v in (x, y)
+    )
+
+
+def _tile_ranges(bounds, zoom):
+    """Диапазоны номеров тайлов, покрывающих bbox, как в mercantile.tiles
+
+    Returns:
+        tuple: (x_min, x_max, y_min, y_max), границы включительно
+    """
+    w, s, e, n = bounds
+    w = max(-180.0, w)
+    s = max(-_MERCATOR_MAX_LAT, s)
+    e = min(180.0, e)
+    n = min(_MERCATOR_MAX_LAT, n)
+    x_min, y_min = _lnglat_to_tile(w, n, zoom)
+    x_max, y_max = _lnglat_to_tile(e - _LL_EPSILON, s + _LL_EPSILON, zoom)
+    return x_min, x_max, y_min, y_max
+
+
+def _tile_polygons(xs, ys, zoom):
+    """Полигоны тайлов по массивам номеров. Координаты и порядок вершин как у mercantile.feature"""
+    z2 = 2.0**zoom
+    west = xs / z2 * 360.0 - 180.0
+    east = (xs + 1) / z2 * 360.0 - 180.0
+    # широты считаются через math по уникальным границам строк,
+    # т.к. numpy может разойтись с mercantile.bounds в последнем знаке
+    edges = np.unique(np.concatenate([ys, ys + 1]))
+    lats = np.array(
+        [degrees(atan(sinh(pi * (1 - 2 * e / z2)))) for e in edges.tolist()]
+    )
+    north = lats[np.searchsorted(edges, ys)]
+    south = lats[np.searchsorted(edges, ys + 1)]
+    return shapely.box(west, south, east, north, ccw=False)
+
+
+def _children(xs, ys):
+    """Номера четырех дочерних тайлов следующего уровня"""
+    xs = np.repeat(xs * 2, 4) + np.tile([0, 0, 1, 1], len(xs))
+    ys = np.repeat(ys * 2, 4) + np.tile([0, 1, 0, 1], len(ys))
+    return xs, ys
+
+
+def _shape_tiles(extents, zooms, fill_area_filter_factor):
+    """Тайлы, пересекающие экстенты, для уровней zooms.
+    Спуск по дереву тайлов от нулевого уровня: на следующий уровень переходят только дети тайлов,
+    пересекающих экстенты, поэтому геометрии создаются лишь для тайлов около экстентов, а не для всего bbox.
+    Дочерний тайл лежит внутри родителя, поэтому если он пересекает экстент, то и родитель тоже
+
+    Returns:
+        dict: {zoom: (xs, ys, polygons)}
+    """
+    bounds = shapely.total_bounds(extents)
+    result = {}
+    xs = ys = np.zeros(1, dtype=np.int64)
+    for zoom in range(max(zooms) + 1):
+        polygons = _tile_polygons(xs, ys, zoom)
+        extent_idx, tile_idx = shapely.STRtree(polygons).query(
+            extents, predicate="intersects"
+        )
+        if zoom in zooms:
+            # как и mercantile.tiles, отсекаются тайлы, которые только касаются bbox с юга и востока
+            x_min, x_max, y_min, y_max = _tile_ranges(bounds, zoom)
+            in_bbox = (xs[tile_idx] >= x_min) & (xs[tile_idx] <= x_max)
+            in_bbox &= (ys[tile_idx] >= y_min) & (ys[tile_idx] <= y_max)
+            idx = _filter_pairs_by_area(
+                polygons,
+                extents,
+                extent_idx[in_bbox],
+                tile_idx[in_bbox],
+                fill_area_filter_factor,
+            )
+            result[zoom] = (xs[idx], ys[idx], polygons[idx])
+        hits = np.unique(tile_idx)
+        xs, ys = _children(xs[hits], ys[hits])
+    return result
+
+
 def tiles_over_shape(geodata, zoom, filter_by_shape=True, fill_area_filter_factor=0.0):
     """Generate slippy tile polygons in GeoDataFrame. Only EPSG:4326!
+    Тайлы совпадают с mercantile.tiles по bbox экстентов, индекс строки - позиция тайла в mercantile.tiles
 
     Args:
         geodata (geopandas.GeoSeries|geopandas.GeoDataFrame): Экстенты, по котором необходимо создать тайлы
-        zoom (int): Z-координата, от которой зависит дробление тайлов
+        zoom (int|list[int]): Z-координата, от которой зависит дробление тайлов. Можно передать несколько уровней
         filter_by_shape (bool, optional): если True, тайлы bbox'а, которые не пересекаются c экстентом, будут отсечены в противном случае тайлы будут распределены по всему bbox
         fill_area_filter_factor (float, optional): коэффициент площади, меньше которой тайл отсекается при filter_by_shape. Например, при коэффициенте равном 0.25, тайл, который покрывает меньше 25% экстента, будет отсечен
 
     Returns:
         geopandas.GeoDataFrame: тайлы и их x,y,z
     """
-    import mercantile
     geoseries = _geo_input_handler(geodata, 4326)
-    x1, y1 = geoseries.bounds.min()[["minx", "miny"]]
-    x2, y2 = geoseries.bounds.max()[["maxx", "maxy"]]
-    features = []
-    for tile in mercantile.tiles(x1, y1, x2, y2, zoom):
-        feature = mercantile.feature(tile)
-        feature["properties"] = {
-            "x": tile.x,
-            "y": tile.y,
-            "z": tile.z,
-        }
-        features.append(feature)
-    tiles = gpd.GeoDataFrame.from_features(
-        {"type": "FeatureCollection", "features": features}, crs=4326
-    )
+    zooms = [int(zoom)] if np.ndim(zoom) == 0 else [int(z) for z in zoom]
+    extents = np.asarray(geoseries.values)
+    bounds = shapely.total_bounds(extents)
     if filter_by_shape:
-        tiles = gpd.GeoDataFrame(
-            _tiles_filtering_by_series(tiles, geoseries, fill_area_filter_factor)
-        )
-    return tiles
+        shape_tiles = _shape_tiles(extents, set(zooms), fill_area_filter_factor)
+    columns = {"geometry": [], "x": [], "y": [], "z": [], "index": []}
+    offset = 0
+    for z in zooms:
+        x_min, x_max, y_min, y_max = _tile_ranges(bounds, z)
+        x_count = max(x_max - x_min + 1, 0)
+        y_count = max(y_max - y_min + 1, 0)
+        if filter_by_shape:
+            xs, ys, polygons = shape_tiles[z]
+        else:
+            xs, ys = np.meshgrid(
+                np.arange(x_min, x_min + x_count),
+                np.arange(y_min, y_min + y_count),
+                indexing="ij",
+            )
+            xs, ys = xs.ravel(), ys.ravel()
+            polygons = _tile_polygons(xs, ys, z)
+        # порядок mercantile.tiles: уровень, затем x, затем y
+        columns["index"].append(offset + (xs - x_min) * y_count + (ys - y_min))
+        offset += x_count * y_count
+        columns["geometry"].append(polygons)
+        columns["x"].append(xs)
+        columns["y"].append(ys)
+        columns["z"].append(np.full(len(xs), z, dtype=np.int64))
+    columns = {k: np.concatenate(v) for k, v in columns.items()}
+    index = columns.pop("index")
+    tiles = gpd.GeoDataFrame(columns, index=index, crs=4326)
+    return tiles.sort_index(kind="stable")
+
+
+def _geometry_digests(geoms, tolerance=None):
+    """Считает 128-битный хэш WKB каждой геометрии
+
+    Args:
+        geoms (numpy.ndarray|geopandas.array.GeometryArray): геометрии
+        tolerance (float, optional): размер сетки, к которой привязываются координаты перед хэшированием
+
+    Returns:
+        numpy.ndarray: массив (N, 2) uint64
+    """
+    geoms = np.asarray(geoms)
+    if tolerance:
+        geoms = shapely.set_precision(geoms, tolerance)
+    wkbs = shapely.to_wkb(geoms)
+    return np.column_stack(
+        [
+            gpd.pd.util.hash_array(wkbs, hash_key="gis_tools_wkb__0"),
+            gpd.pd.util.hash_array(wkbs, hash_key="gis_tools_wkb__1"),
+        ]
+    )
 
 
-def geopandas_drop_duplicates(geodata):
+def geopandas_drop_duplicates(geodata, tolerance=None):
     """https://github.com/geopandas/geopandas/issues/521
 
     !this only works if geometries are point-wise equal, and not topologically equal!
+
+    Входные данные не изменяются, геометрии не пересоздаются - строки отбираются по хэшу WKB
+
+    Args:
+        geodata (geopandas.GeoSeries|geopandas.GeoDataFrame): данные с дубликатами
+        tolerance (float, optional): если задан, координаты перед сравнением привязываются к сетке с таким шагом - так отсекаются и почти совпадающие геометрии
+
+    Returns:
+        geopandas.GeoSeries|geopandas.GeoDataFrame: данные без дубликатов
     """
-    if isinstance(geodata, gpd.GeoDataFrame):
-        geodata["geometry"] = geodata["geometry"].apply(lambda geom: geom.wkb)
-        geodata = geodata.drop_duplicates(["geometry"])
-        geodata["geometry"] = geodata["geometry"].apply(lambda geom: wkb.loads(geom))
-        return geodata
-    elif isinstance(geodata, gpd.GeoSeries):
-        return gpd.GeoSeries(
-            geodata.apply(lambda geom: geom.wkb)
-            .drop_duplicates()
-            .apply(lambda geom: wkb.loads(geom)),
-            crs=geodata.crs,
-        )
+    if isinstance(geodata, (gpd.GeoDataFrame, gpd.GeoSeries)):
+        digests = _geometry_digests(geodata.geometry.values, tolerance)
+        digests = gpd.pd.DataFrame(digests)
+        return geodata[~digests.duplicated().to_numpy()]
     else:
         raise TypeError(geodata)
 
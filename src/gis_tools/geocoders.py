@@ -1,129 +1,219 @@
+import functools
+import inspect
 import logging
 import os
 import re
 import shutil
-import time
-from itertools import chain
 from pathlib import Path
 
-import pymongo
-import requests
 from geopandas import GeoDataFrame, GeoSeries
-from shapely import wkt
 from shapely.geometry import MultiPolygon, Point, Polygon
-from shapely.geometry.base import BaseGeometry
 
 from .geo_utils import convert_to_local_csr
+from .geocoding_cache import lookup, make_key, store
+from .http_utils import HttpClient, batch_client
+from .threads_utils import pool_iter
 
 logger = logging.getLogger(__name__)
-GEOCODING_CACHE_DB = pymongo.MongoClient()["GIS_Tools_Geocoders_cache"]
 
 
-def cache(func):
+class GeocoderError(Exception):
+    """Ошибка запроса к геокодеру (сеть, ключ API и т.п.). Такие ответы не кэшируются"""
+
+
+def cache(func=None, *, normalizers=None):
+    """Кэширует ответы геокодера (геометрии, атрибуты и пустые ответы)
+    в хранилище из geocoding_cache.get_cache_backend(). Имя функции - имя провайдера.
+
+    Аргументы приводятся к сигнатуре функции (с подстановкой значений по умолчанию)
+    и прогоняются через normalizers до поиска в кэше - нормализованные значения
+    идут и в ключ кэша, и в саму функцию. Ключ можно получить через wrapper.cache_key
+
+    Args:
+        normalizers (dict, optional): имя аргумента -> функция нормализации
+    """
+    if func is None:
+        return functools.partial(cache, normalizers=normalizers)
+    signature = inspect.signature(func)
+    normalizers = normalizers or {}
+
+    def bind(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        for name, normalizer in normalizers.items():
+            arguments[name] = normalizer(arguments[name])
+        return arguments
+
+    def cache_key(*args, **kwargs):
+        return make_key(**bind(*args, **kwargs))
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        collection = GEOCODING_CACHE_DB[func.__name__]
-        cache_result = collection.find_one({"args": args, "kwargs": kwargs})
-        if cache_result:
-            return wkt.loads(cache_result["result"])
-        else:
-            result = func(*args, **kwargs)
-            if isinstance(result, BaseGeometry):
-                collection.insert_one(
-                    {"args": args, "kwargs": kwargs, "result": result.wkt}
-                )
+        arguments = bind(*args, **kwargs)
+        key = make_key(**arguments)
+        found, result = lookup(func.__name__, key)
+        if found:
             return result
+        try:
+            result = func(**arguments)
+        except GeocoderError:
+            logger.exception(f"({func.__name__}) Error")
+            return None
+        store(func.__name__, key, result)
+        return result
 
+    wrapper.cache_key = cache_key
     return wrapper
 
 
-@cache
-def here(search_string, return_attrs=False, additional_params=None, restart=0):
-    """Геокодирует адрес с помощью HERE API (требуется ключ в переменных среды)
+HERE_GEOCODE_URL = "https://geocode.search.hereapi.com/v1/geocode"
+YANDEX_GEOCODE_URL = "https://geocode-maps.yandex.ru/1.x"
+_HTTP_CLIENT = None
+
+
+def get_http_client():
+    """Общий HTTP-клиент одиночных запросов к геокодерам"""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = HttpClient(backoff=3)
+    return _HTTP_CLIENT
+
+
+# лексемы адреса разделяются пробельными символами (переносы строк, табуляция и т.п.) и запятыми
+_ADDRESS_SEPARATORS_RE = re.compile(r"[\s,]+")
+
+
+def normalize_address(search_string):
+    """Приводит адрес к каноническому виду, в котором он уходит в геокодер и в ключ кэша
 
     Args:
         search_string (str): адрес
-        additional_params (dict, optional): дополнительные параметры запроса
 
     Returns:
-        shapely.geometry.Point: ответ сервера - точка в epsg4326
+        str: адрес без переносов строк, запятых и повторяющихся лексем
     """
-    TRIES = 5
-    # избавляемся от переносов строки, табуляции и прочего
-    search_string = re.sub(r"\s+", " ", search_string)
-    # убираем повторяющиеся лексемы из запроса
-    args = search_string.split(",")
-    args = [i.strip().split(" ") for i in args]
-    args = chain(*args)
+    seen = set()
     unique_args = []
-    for a in args:
-        if a not in unique_args:
+    for a in _ADDRESS_SEPARATORS_RE.split(search_string):
+        if a and a not in seen:
+            seen.add(a)
             unique_args.append(a)
-    search_string = " ".join(unique_args)
-    # генерируем запрос
-    params = {"q": search_string, "apiKey": os.environ["HERE_API_KEY"], "lang": "ru-RU"}
-    url = "https://geocode.search.hereapi.com/v1/geocode"
+    return " ".join(unique_args)
+
+
+# запятые вместе с окружающими их пробелами и повторами
+_ADDRESS_COMMAS_RE = re.compile(r"\s*,[\s,]*")
+_ADDRESS_SPACES_RE = re.compile(r"\s+")
+
+
+def clean_address(search_string):
+    """Схлопывает пробельные символы и повторяющиеся запятые, не меняя лексем адреса.
+    В отличие от normalize_address не удаляет повторы, поэтому "д. 1, стр. 1" остается как есть
+
+    Args:
+        search_string (str): адрес
+
+    Returns:
+        str: адрес с одиночными пробелами и запятыми
+    """
+    search_string = _ADDRESS_COMMAS_RE.sub(", ", search_string)
+    return _ADDRESS_SPACES_RE.sub(" ", search_string).strip(" ,")
+
+
+def normalize_addresses(addresses, normalizer=normalize_address):
+    """Пакетная версия normalize_address, одинаковые строки нормализуются один раз
+
+    Args:
+        addresses (Iterable[str]): адреса
+        normalizer (function, optional): функция нормализации одного адреса
+
+    Returns:
+        list[str]: нормализованные адреса в исходном порядке
+    """
+    normalized = {}
+    result = []
+    for a in addresses:
+        if a not in normalized:
+            normalized[a] = normalizer(a)
+        result.append(normalized[a])
+    return result
+
+
+def _here_params(search_string, additional_params=None):
+    params = {
+        "q": search_string,
+        "apiKey": os.environ["HERE_API_KEY"],
+        "lang": "ru-RU",
+    }
     if additional_params:
         params = {**params, **additional_params}
-    r = None
+    return params
+
+
+def _here_parse(data, return_attrs=False):
     try:
-        r = requests.get(url, params=params)
-    except Exception:
-        msg = "(HERE) Error"
-        if r:
-            msg += f", status_code {r.status_code}"
-        logger.exception(msg)
-        return
-    if r.status_code in (429,):
-        if restart > TRIES:
-            raise RecursionError
-        logger.info(f"Too many requests, sleep 10... [{restart}/{TRIES}], {r.text}")
-        time.sleep(3)
-        return here(
-            search_string,
-            return_attrs=return_attrs,
-            additional_params=None,
-            restart=restart + 1,
-        )
-    data = r.json()["items"]
-    if len(data) > 0:
-        if len(data) > 1:
-            item = sorted(data, key=lambda x: x["scoring"]["queryScore"], reverse=True)[
-                0
-            ]
-        else:
-            item = data[0]
-        if return_attrs:
-            return item
+        data = data["items"]
+        if len(data) > 0:
+            if len(data) > 1:
+                item = sorted(
+                    data, key=lambda x: x["scoring"]["queryScore"], reverse=True
+                )[0]
+            else:
+                item = data[0]
+            if return_attrs:
+                return item
+            else:
+                x = item["position"]["lng"]
+                y = item["position"]["lat"]
+                pt = Point(x, y)
+                return pt
         else:
-            x = item["position"]["lng"]
-            y = item["position"]["lat"]
-            pt = Point(x, y)
-            return pt
-    else:
-        logger.warning("(HERE) Geocoder return empty list")
+            logger.warning("(HERE) Geocoder return empty list")
+    except (KeyError, IndexError, TypeError) as e:
+        raise GeocoderError(f"(HERE) Malformed response: {str(data)[:200]}") from e
 
 
-@cache
-def yandex(search_string):
-    """Геокодирует адрес с помощью YANDEX MAP API (требуется ключ в переменных среды)
+def _here_request(client, search_string, return_attrs=False, additional_params=None):
+    params = _here_params(search_string, additional_params)
+    try:
+        r = client.get(HERE_GEOCODE_URL, params=params)
+        r.raise_for_status()
+        data = r.json()
+    except Exception as e:
+        raise GeocoderError("(HERE) Request error") from e
+    return _here_parse(data, return_attrs)
+
+
+@cache(normalizers={"search_string": normalize_address})
+def here(search_string, return_attrs=False, additional_params=None):
+    """Геокодирует адрес с помощью HERE API (требуется ключ в переменных среды)
 
     Args:
         search_string (str): адрес
+        return_attrs (bool, optional): вернуть атрибуты найденного объекта вместо точки
+        additional_params (dict, optional): дополнительные параметры запроса
 
     Returns:
         shapely.geometry.Point: ответ сервера - точка в epsg4326
     """
-    endpoint = "https://geocode-maps.yandex.ru/1.x"
-    params = {
+    return _here_request(
+        get_http_client(), search_string, return_attrs, additional_params
+    )
+
+
+def _yandex_params(search_string):
+    return {
         "apikey": os.environ["YANDEX_GEOCODING_API_KEY"],
         "geocode": search_string,
         "format": "json",
     }
-    r = requests.get(endpoint, params=params)
-    data = r.json()
+
+
+def _yandex_parse(data, search_string):
     if data.get("statusCode") == 403:
-        logger.error("(YANDEX) API key blocked")
-    else:
+        raise GeocoderError("(YANDEX) API key blocked")
+    try:
         features = data["response"]["GeoObjectCollection"]["featureMember"]
         if features:
             geodata = features[0]["GeoObject"]
@@ -131,6 +221,97 @@ def yandex(search_string):
             return point
         else:
             logger.warning(f'(YANDEX) Not found "{search_string}"')
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise GeocoderError(f"(YANDEX) Malformed response: {str(data)[:200]}") from e
+
+
+def _yandex_request(client, search_string):
+    try:
+        r = client.get(YANDEX_GEOCODE_URL, params=_yandex_params(search_string))
+        data = r.json()
+        # 403 с телом statusCode разбирает _yandex_parse
+        if r.status_code != 403:
+            r.raise_for_status()
+    except Exception as e:
+        raise GeocoderError("(YANDEX) Request error") from e
+    return _yandex_parse(data, search_string)
+
+
+@cache(normalizers={"search_string": clean_address})
+def yandex(search_string):
+    """Геокодирует адрес с помощью YANDEX MAP API (требуется ключ в переменных среды).
+    Адрес уходит в YANDEX без удаления повторяющихся лексем (см. clean_address)
+
+    Args:
+        search_string (str): адрес
+
+    Returns:
+        shapely.geometry.Point: ответ сервера - точка в epsg4326
+    """
+    return _yandex_request(get_http_client(), search_string)
+
+
+# геокодер, запрос через общий клиент и нормализация адреса
+_PROVIDERS = {
+    "here": (here, _here_request, normalize_address),
+    "yandex": (yandex, _yandex_request, clean_address),
+}
+
+
+def geocode_many(
+    addresses,
+    provider="here",
+    workers=10,
+    rate_limit=None,
+    tries=5,
+    backoff=1.0,
+    **kwargs,
+):
+    """Пакетное геокодирование. Адреса нормализуются (как в here или yandex) и дедуплицируются,
+    ответы из кэша отдаются сразу, остальные запрашиваются параллельно через общий пул соединений
+
+    Args:
+        addresses (Iterable[str]): адреса
+        provider (str, optional): here или yandex
+        workers (int|str|AdaptiveConcurrency, optional): количество одновременных запросов.
+            "adaptive" - подбирается по задержкам и ответам 429 (см. threads_utils.AdaptiveConcurrency)
+        rate_limit (float, optional): максимум запросов в секунду, None - без ограничения
+        tries (int, optional): количество попыток при ответе 429
+        backoff (float, optional): начальная пауза между попытками в секундах
+        **kwargs: дополнительные аргументы геокодера (например, return_attrs для here)
+
+    Returns:
+        list: результаты в порядке входных адресов
+    """
+    geocoder, request, normalizer = _PROVIDERS[provider]
+    normalized = normalize_addresses(addresses, normalizer)
+    results = {}
+    misses = []
+    for address in dict.fromkeys(normalized):
+        found, result = lookup(provider, geocoder.cache_key(address, **kwargs))
+        if found:
+            results[address] = result
+        else:
+            misses.append(address)
+    logger.info(f"({provider}) {len(results)} from cache, {len(misses)} to request")
+
+    def fetch(address):
+        try:
+            result = request(client, address, **kwargs)
+        except GeocoderError:
+            logger.exception(f"({provider}) Error on {address!r}")
+            return None
+        store(provider, geocoder.cache_key(address, **kwargs), result)
+        return result
+
+    workers, client = batch_client(workers, rate_limit, tries, backoff)
+    try:
+        fetched = pool_iter(fetch, misses, workers=workers, unpack_input=False)
+        for address, result in zip(misses, fetched):
+            results[address] = result
+    finally:
+        client.session.close()
+    return [results[a] for a in normalized]
 
 
 def point_to_polygon(pt, radius):
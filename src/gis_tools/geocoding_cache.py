@@ -0,0 +1,277 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+logger = logging.getLogger(__name__)
+DEFAULT_MONGO_DB = "GIS_Tools_Geocoders_cache"
+DEFAULT_SQLITE_PATH = Path.home() / ".gis_tools" / "geocoders_cache.sqlite"
+# время жизни записей в секундах, None - бессрочно
+CACHE_TTL = None
+NEGATIVE_CACHE_TTL = 30 * 24 * 3600
+
+
+def make_key(*args, **kwargs):
+    """Нормализованный хэш аргументов запроса - ключ записи в кэше
+
+    Returns:
+        str: sha1 от json-представления аргументов
+    """
+    raw = json.dumps(
+        [args, kwargs], sort_keys=True, ensure_ascii=False, default=str
+    ).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()
+
+
+def dumps(result):
+    """Сериализует ответ геокодера: первый байт - тип записи, дальше данные.
+    N - пустой ответ, G - геометрия в WKB, J - атрибуты в JSON
+
+    Returns:
+        bytes:
+    """
+    if result is None:
+        return b"N"
+    elif isinstance(result, BaseGeometry):
+        return b"G" + shapely.to_wkb(result)
+    else:
+        return b"J" + json.dumps(result, ensure_ascii=False).encode("utf-8")
+
+
+def loads(payload):
+    """Обратная операция к dumps"""
+    payload = bytes(payload)
+    tag, data = payload[:1], payload[1:]
+    if tag == b"N":
+        return None
+    elif tag == b"G":
+        return shapely.from_wkb(data)
+    elif tag == b"J":
+        return json.loads(data.decode("utf-8"))
+    else:
+        raise ValueError(f"Неизвестный тип записи кэша: {tag}")
+
+
+def set_cache_ttl(ttl=None, negative_ttl=NEGATIVE_CACHE_TTL):
+    """Задает время жизни записей кэша
+
+    Args:
+        ttl (float, optional): время жизни найденных результатов в секундах, None - бессрочно
+        negative_ttl (float, optional): время жизни пустых ответов в секундах, None - бессрочно
+    """
+    global CACHE_TTL, NEGATIVE_CACHE_TTL
+    CACHE_TTL = ttl
+    NEGATIVE_CACHE_TTL = negative_ttl
+
+
+def ttl_for(result):
+    return NEGATIVE_CACHE_TTL if result is None else CACHE_TTL
+
+
+def _expires_at(ttl):
+    if ttl is not None:
+        return time.time() + ttl
+
+
+class CacheBackend:
+    """Интерфейс хранилища кэша геокодеров.
+    provider - имя геокодера, key - результат make_key, value - результат dumps,
+    ttl - время жизни записи в секундах (None - бессрочно).
+    get возвращает None, если записи нет или она устарела
+    """
+
+    def get(self, provider, key):
+        raise NotImplementedError
+
+    def set(self, provider, key, value, ttl=None):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """LRU-кэш в памяти процесса"""
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, provider, key):
+        with self._lock:
+            record = self._data.get((provider, key))
+            if record is None:
+                return None
+            value, expires_at = record
+            if expires_at is not None and expires_at < time.time():
+                del self._data[(provider, key)]
+                return None
+            self._data.move_to_end((provider, key))
+            return value
+
+    def set(self, provider, key, value, ttl=None):
+        with self._lock:
+            self._data[(provider, key)] = (value, _expires_at(ttl))
+            self._data.move_to_end((provider, key))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class SqliteCache(CacheBackend):
+    """Кэш в файле SQLite"""
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "provider TEXT NOT NULL, key TEXT NOT NULL, value BLOB, "
+                "created_at REAL, expires_at REAL, "
+                "PRIMARY KEY (provider, key))"
+            )
+
+    def get(self, provider, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE provider = ? AND key = ? "
+                "AND (expires_at IS NULL OR expires_at >= ?)",
+                (provider, key, time.time()),
+            ).fetchone()
+        if row:
+            return row[0]
+
+    def set(self, provider, key, value, ttl=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache "
+                "(provider, key, value, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (provider, key, value, time.time(), _expires_at(ttl)),
+            )
+
+
+class MongoCache(CacheBackend):
+    """Кэш в MongoDB. Подключение открывается при первом обращении,
+    на каждую коллекцию создается уникальный индекс по ключу и TTL-индекс по сроку жизни
+    """
+
+    def __init__(self, uri=None, db_name=DEFAULT_MONGO_DB):
+        self.uri = uri
+        self.db_name = db_name
+        self._db = None
+        self._indexed = set()
+        self._lock = threading.Lock()
+
+    def _collection(self, provider):
+        if self._db is None or provider not in self._indexed:
+            with self._lock:
+                if self._db is None:
+                    import pymongo
+
+                    self._db = pymongo.MongoClient(self.uri, tz_aware=True)[
+                        self.db_name
+                    ]
+                if provider not in self._indexed:
+                    collection = self._db[provider]
+                    collection.create_index("key", unique=True)
+                    collection.create_index("expires_at", expireAfterSeconds=0)
+                    self._indexed.add(provider)
+        return self._db[provider]
+
+    def get(self, provider, key):
+        doc = self._collection(provider).find_one({"key": key})
+        if doc:
+            expires_at = doc.get("expires_at")
+            # TTL-монитор монги удаляет записи не сразу
+            if expires_at is None or expires_at >= datetime.now(timezone.utc):
+                return doc["result"]
+
+    def set(self, provider, key, value, ttl=None):
+        now = datetime.now(timezone.utc)
+        expires_at = _expires_at(ttl)
+        doc = {
+            "key": key,
+            "provider": provider,
+            "result": value,
+            "created_at": now,
+            "expires_at": (
+                datetime.fromtimestamp(expires_at, timezone.utc) if expires_at else None
+            ),
+        }
+        self._collection(provider).replace_one({"key": key}, doc, upsert=True)
+
+
+_BACKEND = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def _backend_from_spec(spec):
+    if spec == "memory":
+        return MemoryCache()
+    elif spec == "sqlite":
+        return SqliteCache()
+    elif spec.startswith("sqlite:///"):
+        return SqliteCache(spec[len("sqlite:///") :])
+    elif spec == "mongo":
+        return MongoCache()
+    elif spec.startswith("mongodb://") or spec.startswith("mongodb+srv://"):
+        return MongoCache(spec)
+    else:
+        raise ValueError(f"Неизвестный бэкенд кэша: {spec}")
+
+
+def set_cache_backend(backend):
+    """Задает хранилище кэша геокодеров
+
+    Args:
+        backend (CacheBackend|str): экземпляр бэкенда или строка: memory, sqlite, sqlite:///path/to/file, mongo, mongodb://...
+    """
+    global _BACKEND
+    if isinstance(backend, str):
+        backend = _backend_from_spec(backend)
+    with _BACKEND_LOCK:
+        _BACKEND = backend
+
+
+def get_cache_backend():
+    """Возвращает текущее хранилище кэша. По умолчанию берется из переменной среды
+    GIS_TOOLS_GEOCODING_CACHE (см. set_cache_backend), если она не задана - mongo
+
+    Returns:
+        CacheBackend:
+    """
+    global _BACKEND
+    if _BACKEND is None:
+        with _BACKEND_LOCK:
+            if _BACKEND is None:
+                spec = os.environ.get("GIS_TOOLS_GEOCODING_CACHE", "mongo")
+                _BACKEND = _backend_from_spec(spec)
+                logger.debug(f"Geocoding cache backend: {spec}")
+    return _BACKEND
+
+
+def lookup(provider, key):
+    """Ищет ответ геокодера в кэше
+
+    Returns:
+        tuple(bool, object): найдена ли запись и сохраненный результат (может быть None)
+    """
+    payload = get_cache_backend().get(provider, key)
+    if payload is None:
+        return False, None
+    return True, loads(payload)
+
+
+def store(provider, key, result):
+    """Сохраняет ответ геокодера (в том числе пустой) в кэш"""
+    get_cache_backend().set(provider, key, dumps(result), ttl_for(result))
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .threads_utils import _adaptive_concurrency
+
+logger = logging.getLogger(__name__)
+RETRY_STATUS_CODES = (429,)
+# таймаут запроса по умолчанию в секундах: без него зависшее соединение блокирует пакет запросов
+DEFAULT_TIMEOUT = 30
+
+
+class TooManyRequests(Exception):
+    """Сервер продолжает отвечать 429 после всех попыток"""
+
+    status_code = 429
+
+
+class RateLimiter:
+    """Token bucket: не больше rate запросов в секунду, с запасом burst на короткие всплески"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def delay(self):
+        """Забирает токен, если он есть, иначе возвращает время ожидания до следующего"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.delay()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def for_url(self, url):
+        return self
+
+
+class HostRateLimiter:
+    """Отдельный RateLimiter на каждый хост: тайловые серверы и API ограничивают частоту запросов по хосту"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = RateLimiter(self.rate, self.burst)
+            return self._limiters[host]
+
+
+def make_limiter(rate_limit, burst=None, per_host=False):
+    """RateLimiter, HostRateLimiter при per_host или None без ограничения"""
+    if not rate_limit:
+        return None
+    if per_host:
+        return HostRateLimiter(rate_limit, burst)
+    return RateLimiter(rate_limit, burst)
+
+
+def make_session(pool_size=100):
+    """requests.Session с пулом соединений на pool_size подключений к одному хосту"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def retry_delay(response, attempt, backoff):
+    """Пауза перед повтором: Retry-After сервера или экспоненциальный backoff"""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return backoff * 2**attempt
+
+
+class HttpClient:
+    """Общий для потоков HTTP-клиент: пул соединений, ограничение частоты запросов
+    и повтор запросов при ответе 429 с экспоненциальной паузой
+    """
+
+    def __init__(
+        self,
+        session=None,
+        rate_limit=None,
+        burst=None,
+        tries=5,
+        backoff=1.0,
+        pool_size=100,
+        on_throttle=None,
+        per_host=False,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        """
+        Args:
+            session (requests.Session, optional): сессия, по умолчанию make_session(pool_size)
+            rate_limit (float, optional): максимум запросов в секунду, None - без ограничения
+            burst (int, optional): размер корзины токенов, по умолчанию равен rate_limit
+            tries (int, optional): количество попыток при ответе 429
+            backoff (float, optional): начальная пауза между попытками в секундах
+            pool_size (int, optional): размер пула соединений
+            on_throttle (function, optional): вызывается без аргументов на каждый ответ 429,
+                например threads_utils.AdaptiveConcurrency.throttled
+            per_host (bool, optional): если True, rate_limit действует отдельно для каждого хоста
+            timeout (float, optional): таймаут запроса в секундах, если он не передан в get/request
+        """
+        self.session = session or make_session(pool_size)
+        self.limiter = make_limiter(rate_limit, burst, per_host)
+        self.tries = tries
+        self.backoff = backoff
+        self.on_throttle = on_throttle
+        self.timeout = timeout
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.tries):
+            if self.limiter:
+                self.limiter.for_url(url).acquire()
+            r = self.session.request(method, url, **kwargs)
+            if r.status_code not in RETRY_STATUS_CODES:
+                return r
+            if self.on_throttle:
+                self.on_throttle()
+            delay = retry_delay(r, attempt, self.backoff)
+            logger.info(
+                f"Too many requests, sleep {delay:.1f}... [{attempt + 1}/{self.tries}]"
+            )
+            time.sleep(delay)
+        raise TooManyRequests(url)
+
+
+class ClientSession:
+    """Обертка над requests.Session клиента для функций, которые ожидают сессию:
+    запросы идут через HttpClient.request (ограничение частоты и повторы при 429),
+    остальные атрибуты (headers, cookies и т.п.) берутся у сессии
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def request(self, method, url, **kwargs):
+        return self.client.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client.session, name)
+
+
+class AsyncHttpClient:
+    """Асинхронный аналог HttpClient поверх aiohttp: пул соединений, ограничение частоты запросов
+    и повтор запросов при ответе 429. Используется как async context manager
+    """
+
+    def __init__(
+        self,
+        rate_limit=None,
+        burst=None,
+        tries=5,
+        backoff=1.0,
+        pool_size=100,
+        on_throttle=None,
+        per_host=False,
+    ):
+        """
+        Args:
+            rate_limit, burst, tries, backoff, pool_size, on_throttle, per_host: как в HttpClient
+        """
+        self.limiter = make_limiter(rate_limit, burst, per_host)
+        self.tries = tries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.on_throttle = on_throttle
+        self.session = None
+
+    async def __aenter__(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def get(self, url, **kwargs):
+        """
+        Returns:
+            tuple(int, bytes): статус и тело ответа
+        """
+        for attempt in range(self.tries):
+            if self.limiter:
+                limiter = self.limiter.for_url(url)
+                while wait := limiter.delay():
+                    await asyncio.sleep(wait)
+            async with self.session.get(url, **kwargs) as r:
+                if r.status not in RETRY_STATUS_CODES:
+                    return r.status, await r.read()
+                delay = retry_delay(r, attempt, self.backoff)
+            if self.on_throttle:
+                self.on_throttle()
+            logger.info(
+                f"Too many requests, sleep {delay:.1f}... [{attempt + 1}/{self.tries}]"
+            )
+            await asyncio.sleep(delay)
+        raise TooManyRequests(url)
+
+
+def batch_client(
+    workers, rate_limit, tries, backoff, per_host=False, client_class=HttpClient
+):
+    """HTTP-клиент пакетных запросов. При адаптивном количестве потоков
+    (workers="adaptive" или AdaptiveConcurrency) каждый ответ 429 уменьшает лимит запросов в работе
+
+    Returns:
+        tuple(int|AdaptiveConcurrency, HttpClient): workers для pool_iter и клиент
+    """
+    concurrency = _adaptive_concurrency(workers)
+    client = client_class(
+        rate_limit=rate_limit,
+        tries=tries,
+        backoff=backoff,
+        pool_size=concurrency.max_limit if concurrency else workers,
+        on_throttle=concurrency.throttled if concurrency else None,
+        per_host=per_host,
+    )
+    return concurrency or workers, client
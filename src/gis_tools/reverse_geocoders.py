@@ -1,18 +1,231 @@
+import json
 import logging
 import os
 import re
+import threading
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import geopandas as gpd
-import requests
+import numpy as np
+import shapely
 from shapely.geometry import MultiPoint, Point
 
+from .geocoders import GeocoderError, cache, get_http_client
+from .geocoding_cache import lookup, make_key, store
+from .http_utils import batch_client
+from .threads_utils import chunker, pool_iter
+
 logger = logging.getLogger(__name__)
-RUSSIA_CITIES = RUSSIA_REGIONS = RUSSIA_COUNTRY = None
 RUSSIA_REGIONS_PATH = (
     Path(__file__).parent / "gpkg" / "Russia_boundaries.gpkg"
 ).resolve()
+# копия пишется в пользовательскую папку: каталог пакета может быть недоступен для записи
+RUSSIA_SNAPSHOT_FOLDER = Path(
+    os.environ.get(
+        "GIS_TOOLS_SNAPSHOT_FOLDER", Path.home() / ".gis_tools" / "layers_snapshot"
+    )
+)
+RUSSIA_LAYERS = ("russia", "regions", "cities")
+# GeoParquet-копия слоев gpkg (нужен pyarrow), отключается GIS_TOOLS_LAYERS_SNAPSHOT=0
+USE_LAYERS_SNAPSHOT = os.environ.get("GIS_TOOLS_LAYERS_SNAPSHOT", "1") != "0"
+HERE_REVGEOCODE_URL = "https://revgeocode.search.hereapi.com/v1/revgeocode"
+# знаков после запятой в координатах ключа кэша обратного геокодирования (~1 м)
+REVGEOCODE_PRECISION = 5
+
+
+def _gpkg_signature():
+    stat = RUSSIA_REGIONS_PATH.stat()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _snapshot_paths(layer):
+    return (
+        RUSSIA_SNAPSHOT_FOLDER / f"{layer}.parquet",
+        RUSSIA_SNAPSHOT_FOLDER / f"{layer}.json",
+    )
+
+
+def _read_snapshot(layer):
+    parquet_path, meta_path = _snapshot_paths(layer)
+    try:
+        signature = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if signature != _gpkg_signature():
+        logger.debug(f"Snapshot of {layer} is outdated")
+        return None
+    try:
+        return gpd.read_parquet(parquet_path, memory_map=True)
+    # поврежденный или недописанный parquet - pyarrow.lib.ArrowInvalid (ValueError)
+    except (ImportError, OSError, ValueError):
+        logger.debug(f"Can't read snapshot of {layer}", exc_info=True)
+        return None
+
+
+def _write_snapshot(layer, gdf):
+    parquet_path, meta_path = _snapshot_paths(layer)
+    signature = _gpkg_signature()
+    RUSSIA_SNAPSHOT_FOLDER.mkdir(parents=True, exist_ok=True)
+    # пишем во временные файлы и подменяем, чтобы параллельные процессы не читали недописанное
+    tmp_suffix = f".{os.getpid()}.tmp"
+    tmp_parquet = parquet_path.with_name(parquet_path.name + tmp_suffix)
+    tmp_meta = meta_path.with_name(meta_path.name + tmp_suffix)
+    gdf.to_parquet(tmp_parquet)
+    tmp_meta.write_text(json.dumps(signature), encoding="utf-8")
+    os.replace(tmp_parquet, parquet_path)
+    os.replace(tmp_meta, meta_path)
+
+
+def build_layers_snapshot(layers=RUSSIA_LAYERS):
+    """Собирает GeoParquet-копию слоев Russia_boundaries.gpkg.
+    Копия пересобирается автоматически при изменении gpkg, но ее удобно построить заранее
+    (например, при сборке образа), чтобы воркеры сразу читали быстрый формат
+
+    Args:
+        layers (Iterable[str], optional): слои gpkg
+    """
+    for layer in layers:
+        _write_snapshot(layer, gpd.read_file(RUSSIA_REGIONS_PATH, layer=layer))
+
+
+def _read_layer(layer):
+    """Читает слой Russia_boundaries.gpkg, по возможности из GeoParquet-копии"""
+    if USE_LAYERS_SNAPSHOT:
+        gdf = _read_snapshot(layer)
+        if gdf is not None:
+            return gdf
+    gdf = gpd.read_file(RUSSIA_REGIONS_PATH, layer=layer)
+    if USE_LAYERS_SNAPSHOT:
+        try:
+            _write_snapshot(layer, gdf)
+        except (ImportError, OSError):
+            _warn_snapshot_write(layer)
+    return gdf
+
+
+_SNAPSHOT_WRITE_WARNED = False
+
+
+def _warn_snapshot_write(layer):
+    """Без копии каждый процесс заново читает gpkg, поэтому первая ошибка записи - warning, остальные - debug"""
+    global _SNAPSHOT_WRITE_WARNED
+    if _SNAPSHOT_WRITE_WARNED:
+        logger.debug(f"Can't write snapshot of {layer}", exc_info=True)
+        return
+    _SNAPSHOT_WRITE_WARNED = True
+    logger.warning(
+        f"Can't write snapshot of {layer} to {RUSSIA_SNAPSHOT_FOLDER}, "
+        "set GIS_TOOLS_SNAPSHOT_FOLDER to a writable folder",
+        exc_info=True,
+    )
+
+
+def _memory_footprint(item):
+    """Примерный объем памяти слоя в байтах: колонки pandas плюс координаты геометрий"""
+    if isinstance(item, gpd.GeoDataFrame):
+        coords = shapely.get_num_coordinates(np.asarray(item.geometry.values)).sum()
+        return int(item.memory_usage(deep=True).sum() + coords * 16)
+
+
+class LayerRegistry:
+    """Потокобезопасный реестр лениво загружаемых слоев и производных от них структур
+    (индексы, матчеры). Каждый объект создается один раз, даже если его одновременно
+    запросили сотни потоков: у каждого имени свой замок (double-checked locking),
+    поэтому разные слои могут грузиться параллельно
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._items = {}
+        self._stats = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """
+        Args:
+            name (str): имя объекта
+            factory (function): функция без аргументов, создающая объект
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._items.pop(name, None)
+            self._stats.pop(name, None)
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        item = self._items.get(name)
+        if item is not None:
+            return item
+        with self._name_lock(name):
+            item = self._items.get(name)
+            if item is None:
+                start = time.perf_counter()
+                item = self._factories[name]()
+                load_time = time.perf_counter() - start
+                memory = _memory_footprint(item)
+                self._stats[name] = {"load_time": load_time, "memory": memory}
+                self._items[name] = item
+                msg = f"{name} loaded in {load_time:.2f}s"
+                if memory is not None:
+                    msg += f", ~{memory / 2**20:.1f} MB"
+                logger.info(msg)
+        return item
+
+    def preload(self, names=None, workers=4):
+        """Загружает объекты заранее, параллельно
+
+        Args:
+            names (Iterable[str], optional): имена объектов, по умолчанию все зарегистрированные
+            workers (int, optional): количество потоков загрузки
+        """
+        names = list(names or self._factories)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self.get, names))
+
+    def stats(self):
+        """
+        Returns:
+            dict: имя -> {"load_time": секунды, "memory": байты или None} для загруженных объектов
+        """
+        return {name: dict(stat) for name, stat in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._stats.clear()
+
+
+def make_layers_registry():
+    """Реестр слоев Russia_boundaries.gpkg и построенных по ним индексов"""
+    registry = LayerRegistry()
+    for layer in RUSSIA_LAYERS:
+        registry.register(layer, lambda layer=layer: _read_layer(layer))
+    for layer in _NAMED_LAYERS:
+        registry.register(
+            f"names:{layer}", lambda layer=layer: _build_name_index(layer)
+        )
+        registry.register(f"locator:{layer}", lambda layer=layer: _build_locator(layer))
+    registry.register("address_matcher", lambda: AddressMatcher(get_cities_gdf()))
+    return registry
+
+
+def preload_layers(names=RUSSIA_LAYERS):
+    """Заранее загружает слои (и, если указаны, индексы: names:cities, locator:regions,
+    address_matcher и т.п.). Удобно вызывать при старте сервиса или как initializer пула процессов
+    """
+    LAYERS.preload(names)
+
+
+def layers_stats():
+    """Время загрузки и объем памяти загруженных слоев, см. LayerRegistry.stats"""
+    return LAYERS.stats()
 
 
 def get_country_gdf():
@@ -21,10 +234,7 @@ def get_country_gdf():
     Returns:
         GeoDataFrame:
     """
-    global RUSSIA_COUNTRY
-    if RUSSIA_COUNTRY is None:
-        RUSSIA_COUNTRY = gpd.read_file(RUSSIA_REGIONS_PATH, layer="russia")
-    return RUSSIA_COUNTRY
+    return LAYERS.get("russia")
 
 
 def get_cities_gdf():
@@ -33,17 +243,23 @@ def get_cities_gdf():
     Returns:
         GeoDataFrame: слой городов России с данными из Википедии
     """
-    global RUSSIA_CITIES
-    if RUSSIA_CITIES is None:
-        RUSSIA_CITIES = gpd.read_file(RUSSIA_REGIONS_PATH, layer="cities")
-    return RUSSIA_CITIES
+    return LAYERS.get("cities")
 
 
 def get_city_geometry(city_name):
-    gdf = get_cities_gdf()
-    gdf = gdf[gdf["Город"].str.strip().str.lower() == city_name.strip().lower()]
-    if len(gdf) > 0:
-        return gdf.geometry.iloc[0]
+    return _lookup_geometry("cities", city_name)
+
+
+def get_cities_geometries(city_names):
+    """Пакетная версия get_city_geometry
+
+    Args:
+        city_names (pandas.Series|Iterable[str]): названия городов
+
+    Returns:
+        geopandas.GeoSeries: геометрии в порядке (и с индексом) входных названий, None для ненайденных
+    """
+    return _lookup_geometries("cities", city_names)
 
 
 def get_regions_gdf():
@@ -52,17 +268,206 @@ def get_regions_gdf():
     Returns:
         GeoDataFrame: слой регионов России (OSM)
     """
-    global RUSSIA_REGIONS
-    if RUSSIA_REGIONS is None:
-        RUSSIA_REGIONS = gpd.read_file(RUSSIA_REGIONS_PATH, layer="regions")
-    return RUSSIA_REGIONS
+    return LAYERS.get("regions")
 
 
 def get_region_geometry(region_name):
-    gdf = get_regions_gdf()
-    gdf = gdf[gdf["name"].str.strip().str.lower() == region_name.strip().lower()]
-    if len(gdf) > 0:
-        return gdf.geometry.iloc[0]
+    return _lookup_geometry("regions", region_name)
+
+
+def get_regions_geometries(region_names):
+    """Пакетная версия get_region_geometry
+
+    Args:
+        region_names (pandas.Series|Iterable[str]): названия регионов
+
+    Returns:
+        geopandas.GeoSeries: геометрии в порядке (и с индексом) входных названий, None для ненайденных
+    """
+    return _lookup_geometries("regions", region_names)
+
+
+# слой -> функция загрузки и колонка с названием объекта
+_NAMED_LAYERS = {
+    "cities": (get_cities_gdf, "Город"),
+    "regions": (get_regions_gdf, "name"),
+}
+
+
+def _name_key(name):
+    return name.strip().casefold()
+
+
+def _build_name_index(layer):
+    """Словарь "название в нижнем регистре -> номер первой строки слоя" """
+    get_gdf, column = _NAMED_LAYERS[layer]
+    index = {}
+    for i, name in enumerate(get_gdf()[column]):
+        if isinstance(name, str):
+            index.setdefault(_name_key(name), i)
+    return index
+
+
+def _get_name_index(layer):
+    return LAYERS.get(f"names:{layer}")
+
+
+def _lookup_geometry(layer, name):
+    i = _get_name_index(layer).get(_name_key(name))
+    if i is not None:
+        get_gdf, _ = _NAMED_LAYERS[layer]
+        return get_gdf().geometry.iloc[i]
+
+
+def _lookup_geometries(layer, names):
+    get_gdf, _ = _NAMED_LAYERS[layer]
+    geometry = get_gdf().geometry
+    index = _get_name_index(layer)
+    names = gpd.pd.Series(names, dtype=object)
+    positions = np.array(
+        [index.get(_name_key(n), -1) if isinstance(n, str) else -1 for n in names],
+        dtype=np.int64,
+    )
+    found = positions >= 0
+    result = np.full(len(names), None, dtype=object)
+    result[found] = np.asarray(geometry.values)[positions[found]]
+    return gpd.GeoSeries(result, index=names.index, crs=geometry.crs)
+
+
+class PointLocator:
+    """Поиск полигона слоя, в котором лежит точка: кандидаты отбираются по STRtree,
+    проверка contains идет по подготовленным (prepared) полигонам
+    """
+
+    def __init__(self, gdf, name_column):
+        self.geoms = np.asarray(gdf.geometry.values)
+        shapely.prepare(self.geoms)
+        self.tree = shapely.STRtree(self.geoms)
+        self.names = gdf[name_column].to_numpy()
+
+    def locate(self, points):
+        """
+        Args:
+            points (Iterable[shapely.geometry.Point]|numpy.ndarray): точки (или мультиточки) либо массив координат формы (N, 2)
+
+        Returns:
+            numpy.ndarray: названия полигонов, None для точек вне слоя
+        """
+        points = np.asarray(points)
+        # пустой список дает массив float64, с которым не работает STRtree
+        if points.size == 0:
+            return np.empty(0, dtype=object)
+        if points.ndim == 2:
+            points = shapely.points(points)
+        pt_idx, poly_idx = self.tree.query(points)
+        hit = shapely.contains(self.geoms[poly_idx], points[pt_idx])
+        pt_idx, poly_idx = pt_idx[hit], poly_idx[hit]
+        # как и при переборе слоя, берем первый по порядку подходящий полигон
+        order = np.lexsort((poly_idx, pt_idx))
+        pt_idx, poly_idx = pt_idx[order], poly_idx[order]
+        _, first = np.unique(pt_idx, return_index=True)
+        result = np.full(len(points), None, dtype=object)
+        result[pt_idx[first]] = self.names[poly_idx[first]]
+        return result
+
+
+def _build_locator(layer):
+    get_gdf, column = _NAMED_LAYERS[layer]
+    return PointLocator(get_gdf(), column)
+
+
+def _get_locator(layer):
+    return LAYERS.get(f"locator:{layer}")
+
+
+def _trie_pattern(words):
+    """Собирает из слов регулярное выражение в виде префиксного дерева:
+    общие префиксы не дублируются, более длинные варианты проверяются первыми
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char != ""
+        ]
+        if not branches:
+            return ""
+        pattern = "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            pattern += "?"
+        return pattern
+
+    return build(trie)
+
+
+class AddressMatcher:
+    """Поиск городов и регионов в сырых строках адресов.
+    Регулярные выражения и словари соответствий собираются один раз по слою городов
+    """
+
+    def __init__(self, cities_gdf):
+        self.city_regions = {}
+        for city, region in zip(cities_gdf["Город"], cities_gdf["Регион"]):
+            self.city_regions.setdefault(city.lower(), region)
+        self.region_names = {}
+        for region_re, region in zip(cities_gdf["Регион_re"], cities_gdf["Регион"]):
+            self.region_names.setdefault(region_re.lower(), region)
+        self.city_re = re.compile(
+            r"\b" + _trie_pattern(self.city_regions) + r"\b", flags=re.IGNORECASE
+        )
+        self.region_re = re.compile(
+            _trie_pattern(self.region_names), flags=re.IGNORECASE
+        )
+
+    def city(self, address):
+        if isinstance(address, str):
+            match = self.city_re.search(address)
+            if match:
+                return match.group(0).capitalize()
+
+    def region(self, address):
+        if isinstance(address, str):
+            match = self.region_re.search(address)
+            if match:
+                return self.region_names.get(match.group(0).lower())
+            city = self.city(address)
+            if city:
+                return self.city_regions.get(city.lower())
+
+    @staticmethod
+    def _map_unique(func, addresses):
+        addresses = gpd.pd.Series(addresses)
+        codes, uniques = gpd.pd.factorize(addresses)
+        results = np.array([func(a) for a in uniques] + [None], dtype=object)
+        # код -1 (пустые значения) указывает на последний элемент - None
+        return gpd.pd.Series(results[codes], index=addresses.index, dtype=object)
+
+    def cities(self, addresses):
+        """Пакетный поиск городов: каждый уникальный адрес разбирается один раз
+
+        Args:
+            addresses (pandas.Series|Iterable[str]): сырые строки адресов
+
+        Returns:
+            pandas.Series: названия городов (или None) с индексом входных данных
+        """
+        return self._map_unique(self.city, addresses)
+
+    def regions(self, addresses):
+        """Пакетный поиск регионов, аналогично cities"""
+        return self._map_unique(self.region, addresses)
+
+
+def get_address_matcher():
+    """Возвращает AddressMatcher по слою городов России"""
+    return LAYERS.get("address_matcher")
 
 
 def extract_city_by_address(address):
@@ -74,12 +479,19 @@ def extract_city_by_address(address):
     Returns:
         str: название города
     """
-    if isinstance(address, str):
-        cities = get_cities_gdf()["Город"].tolist()
-        cities_pattern = "(" + "|".join(["\\b" + i + "\\b" for i in set(cities)]) + ")"
-        result = re.findall(cities_pattern, address, flags=re.IGNORECASE)
-        if result:
-            return result[0].capitalize()
+    return get_address_matcher().city(address)
+
+
+def extract_cities_by_addresses(addresses):
+    """Пакетная версия extract_city_by_address
+
+    Args:
+        addresses (pandas.Series|Iterable[str]): сырые строки адресов
+
+    Returns:
+        pandas.Series: названия городов
+    """
+    return get_address_matcher().cities(addresses)
 
 
 def extract_city_by_point(pt):
@@ -95,14 +507,23 @@ def extract_city_by_point(pt):
         TypeError: неизвестный тип геометрии
     """
     if isinstance(pt, Point) or isinstance(pt, MultiPoint):
-        russia_cities = get_cities_gdf()
-        reg = russia_cities.loc[russia_cities["geometry"].contains(pt), "Город"]
-        if len(reg) > 0:
-            return reg.iloc[0]
+        return _get_locator("cities").locate([pt])[0]
     else:
         raise TypeError(f"Unknown type {type(pt)}")
 
 
+def extract_city_by_points(points):
+    """Векторная версия extract_city_by_point - один запрос к пространственному индексу
+
+    Args:
+        points (Iterable[shapely.geometry.Point]|numpy.ndarray): точки или массив координат (N, 2)
+
+    Returns:
+        numpy.ndarray: названия городов, None для точек вне городов
+    """
+    return _get_locator("cities").locate(points)
+
+
 def extract_region_by_address(address):
     """Функция поиска региона в неподготовленной сырой строке
 
@@ -112,28 +533,19 @@ def extract_region_by_address(address):
     Returns:
         str: название региона
     """
-    if isinstance(address, str):
-        regions = get_cities_gdf()["Регион_re"].tolist()
-        regions_pattern = "(" + "|".join([i for i in set(regions)]) + ")"
-        result = re.findall(regions_pattern, address, flags=re.IGNORECASE)
-        if result:
-            region = (
-                get_cities_gdf()
-                .loc[
-                    get_cities_gdf()["Регион_re"].str.lower() == result[0].lower(),
-                    "Регион",
-                ]
-                .iloc[0]
-            )
-            return region
-        else:
-            city = extract_city_by_address(address)
-            if city:
-                region = get_cities_gdf().loc[
-                    get_cities_gdf()["Город"].str.lower() == city.lower(), "Регион"
-                ]
-                if len(region) > 0:
-                    return region.iloc[0]
+    return get_address_matcher().region(address)
+
+
+def extract_regions_by_addresses(addresses):
+    """Пакетная версия extract_region_by_address
+
+    Args:
+        addresses (pandas.Series|Iterable[str]): сырые строки адресов
+
+    Returns:
+        pandas.Series: названия регионов
+    """
+    return get_address_matcher().regions(addresses)
 
 
 def extract_region_by_point(pt):
@@ -149,30 +561,155 @@ def extract_region_by_point(pt):
         TypeError: неизвестный тип геометрии
     """
     if isinstance(pt, Point) or isinstance(pt, MultiPoint):
-        russia_regions = get_regions_gdf()
-        reg = russia_regions.loc[russia_regions["geometry"].contains(pt), "name"]
-        if len(reg) > 0:
-            return reg.iloc[0]
+        return _get_locator("regions").locate([pt])[0]
     else:
         raise TypeError(f"Unknown type {type(pt)}")
 
 
-def here_address_by_point(pt):
-    """Ищет адрес по точке при помощи HERE API. Требуется ключ api в переменных среды
+def extract_region_by_points(points):
+    """Векторная версия extract_region_by_point - один запрос к пространственному индексу
 
     Args:
-        pt (shapely.geometry.Point): точка поиска
+        points (Iterable[shapely.geometry.Point]|numpy.ndarray): точки или массив координат (N, 2)
 
     Returns:
-        str: строковый адрес
+        numpy.ndarray: названия регионов, None для точек вне регионов
     """
-    params = {
+    return _get_locator("regions").locate(points)
+
+
+LAYERS = make_layers_registry()
+
+
+def round_point(pt, precision=None):
+    """Округляет координаты точки - по округленной точке строится ключ кэша обратного геокодирования
+
+    Args:
+        pt (shapely.geometry.Point): точка
+        precision (int, optional): знаков после запятой, по умолчанию REVGEOCODE_PRECISION
+
+    Returns:
+        shapely.geometry.Point:
+    """
+    if precision is None:
+        precision = REVGEOCODE_PRECISION
+    return Point(round(pt.x, precision), round(pt.y, precision))
+
+
+def _here_revgeocode_params(pt):
+    return {
         "at": f"{pt.y},{pt.x}",
         "apiKey": os.environ["HERE_API_KEY"],
         "lang": "ru-RU",
     }
-    url = "https://revgeocode.search.hereapi.com/v1/revgeocode"
-    r = requests.get(url, params=params)
-    items = r.json()["items"]
-    closest_item = min(items, key=lambda x: x.get("distance", 0))
-    return closest_item["address"]["label"]
+
+
+def _here_revgeocode_parse(data):
+    try:
+        items = data["items"]
+        if not items:
+            logger.warning("(HERE) Reverse geocoder return empty list")
+            return None
+        closest_item = min(items, key=lambda x: x.get("distance", 0))
+        return closest_item["address"]["label"]
+    except (KeyError, TypeError, AttributeError) as e:
+        raise GeocoderError(
+            f"(HERE) Malformed reverse response: {str(data)[:200]}"
+        ) from e
+
+
+def _here_revgeocode_request(client, pt):
+    try:
+        r = client.get(HERE_REVGEOCODE_URL, params=_here_revgeocode_params(pt))
+        r.raise_for_status()
+        data = r.json()
+    except Exception as e:
+        raise GeocoderError("(HERE) Reverse request error") from e
+    return _here_revgeocode_parse(data)
+
+
+def _revgeocode_key(pt):
+    """Ключ кэша here_address_by_point для уже округленной точки. Совпадает с here_address_by_point.cache_key
+    при точности REVGEOCODE_PRECISION, но не округляет точку повторно
+    """
+    return make_key(pt=pt)
+
+
+@cache(normalizers={"pt": round_point})
+def here_address_by_point(pt):
+    """Ищет адрес по точке при помощи HERE API. Требуется ключ api в переменных среды.
+    Координаты округляются до REVGEOCODE_PRECISION знаков, ответы кэшируются
+
+    Args:
+        pt (shapely.geometry.Point): точка поиска
+
+    Returns:
+        str: строковый адрес
+    """
+    return _here_revgeocode_request(get_http_client(), pt)
+
+
+def reverse_geocode_many(
+    points,
+    precision=None,
+    with_address=True,
+    chunk_size=10_000,
+    workers=10,
+    rate_limit=None,
+    tries=5,
+    backoff=1.0,
+):
+    """Пакетное обратное геокодирование. Регион и город определяются по локальным слоям,
+    адрес - через HERE: точки округляются до precision знаков, одинаковые точки
+    и ответы из кэша в HERE не отправляются. Точки обрабатываются пачками по chunk_size,
+    результаты отдаются по мере готовности пачек в порядке входных точек
+
+    Args:
+        points (Iterable[shapely.geometry.Point]): точки
+        precision (int, optional): знаков после запятой для ключа кэша, по умолчанию REVGEOCODE_PRECISION
+        with_address (bool, optional): если False, HERE не используется - только регион и город
+        chunk_size (int, optional): размер пачки точек
+        workers (int|str|AdaptiveConcurrency, optional): количество одновременных запросов к HERE,
+            "adaptive" - подбирается по задержкам и ответам 429 (см. geocoders.geocode_many)
+        rate_limit (float, optional): максимум запросов в секунду, None - без ограничения
+        tries (int, optional): количество попыток при ответе 429
+        backoff (float, optional): начальная пауза между попытками в секундах
+
+    Yields:
+        dict: {"region": ..., "city": ..., "address": ...}
+    """
+    workers, client = batch_client(workers, rate_limit, tries, backoff)
+    provider = here_address_by_point.__name__
+
+    def fetch(pt):
+        try:
+            result = _here_revgeocode_request(client, pt)
+        except GeocoderError:
+            logger.exception(f"(HERE) Error on {pt}")
+            return None
+        store(provider, _revgeocode_key(pt), result)
+        return result
+
+    try:
+        for chunk in chunker(points, chunk_size):
+            regions = extract_region_by_points(chunk)
+            cities = extract_city_by_points(chunk)
+            addresses = [None] * len(chunk)
+            if with_address:
+                rounded = [round_point(pt, precision) for pt in chunk]
+                known = {}
+                misses = []
+                for pt in dict.fromkeys(rounded):
+                    found, result = lookup(provider, _revgeocode_key(pt))
+                    if found:
+                        known[pt] = result
+                    else:
+                        misses.append(pt)
+                fetched = pool_iter(fetch, misses, workers=workers, unpack_input=False)
+                for pt, result in zip(misses, fetched):
+                    known[pt] = result
+                addresses = [known[pt] for pt in rounded]
+            for region, city, address in zip(regions, cities, addresses):
+                yield {"region": region, "city": city, "address": address}
+    finally:
+        client.session.close()
@@ -1,5 +1,15 @@
 import logging
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from itertools import islice
+from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
@@ -19,67 +29,653 @@ def chunker(iterator, size):
         yield chunk
 
 
-def pool_execute(func, inputs=None, workers=100, pool_type="thread", unpack_input=True):
+def _executor_class(pool_type):
+    if pool_type == "thread":
+        return ThreadPoolExecutor
+    elif pool_type == "process":
+        return ProcessPoolExecutor
+    else:
+        raise TypeError(f"Неверный параметр pool_type={pool_type}")
+
+
+ERROR_POLICIES = ("raise", "collect", "skip")
+
+
+def _call(func, args, unpack_input, retries=0, backoff=1.0):
+    for attempt in range(retries + 1):
+        try:
+            if (isinstance(args, list) or isinstance(args, tuple)) and unpack_input:
+                return func(*args)
+            elif isinstance(args, dict) and unpack_input:
+                return func(**args)
+            else:
+                return func(args)
+        except Exception:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+            logger.warning(
+                f"Error on args {args}, retry in {delay:.1f}s [{attempt + 1}/{retries}]",
+                exc_info=True,
+            )
+            time.sleep(delay)
+
+
+class TaskError:
+    """Failed task: index and args of input and raised exception"""
+
+    def __init__(self, index, args, exception):
+        self.index = index
+        self.args = args
+        self.exception = exception
+
+    def __repr__(self):
+        return f"TaskError(index={self.index}, args={self.args!r}, exception={self.exception!r})"
+
+
+class PoolResults(list):
+    """List of func results with report of failed inputs in errors: {input index: TaskError}"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.errors = {}
+
+
+def _check_error_policy(errors, allowed=ERROR_POLICIES):
+    if errors not in allowed:
+        raise ValueError(f"Неверный параметр errors={errors}, возможные: {allowed}")
+
+
+class Checkpoint:
+    """File with indexes of processed inputs, one per line.
+    Used by pool_iter to skip already processed inputs after restart
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self._file = None
+        self._flushed = 0
+
+    def load(self):
+        if not self.path.exists():
+            return set()
+        with open(self.path, encoding="utf-8") as file:
+            return {int(line) for line in file if line.strip()}
+
+    def mark(self, index):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(f"{index}\n")
+        now = time.monotonic()
+        if now - self._flushed > self.flush_interval:
+            self._file.flush()
+            self._flushed = now
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class AutoChunkSize:
+    """Chunk size for pool_iter(chunksize="auto"): picked from measured time of done chunks
+    so that one chunk takes about target seconds in worker
+    """
+
+    def __init__(self, target=0.2, max_size=10_000):
+        self.target = target
+        self.max_size = max_size
+        self.size = 1
+
+    def update(self, elapsed, count):
+        per_task = elapsed / count
+        if per_task > 0:
+            size = int(self.target / per_task)
+        else:
+            size = self.max_size
+        self.size = max(1, min(self.max_size, size))
+
+
+def _call_chunk(func, chunk, unpack_input, retries=0, backoff=1.0):
+    """Runs func on every args of chunk in worker.
+    Returns list of (is_ok, result or exception, seconds spent)
+    """
+    outcomes = []
+    for args in chunk:
+        start = time.perf_counter()
+        try:
+            result = _call(func, args, unpack_input, retries, backoff)
+        except Exception as e:
+            outcomes.append((False, e, time.perf_counter() - start))
+        else:
+            outcomes.append((True, result, time.perf_counter() - start))
+    return outcomes
+
+
+class PoolStats:
+    """Snapshot of pool progress, passed to progress callback
+
+    Attributes:
+        done (int): count of successfully done inputs
+        errors (int): count of failed inputs
+        in_flight (int): count of submitted but not finished inputs
+        total (int|None): count of inputs, if known
+        elapsed (float): seconds from start
+        throughput (float): finished inputs per second
+        latency (dict): func run time percentiles over recent inputs in seconds - {50: ..., 90: ..., 99: ...}
+        eta (float|None): seconds left, if total is known
+        error_rate (float): share of failed inputs
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return f"PoolStats({self.__dict__})"
+
+    def __str__(self):
+        msg = f"Done {self.done + self.errors}"
+        if self.total is not None:
+            msg += f" out {self.total}"
+        msg += f" ({self.throughput:.1f}/s"
+        if self.latency:
+            msg += f", p50 {self.latency[50]:.3f}s, p99 {self.latency[99]:.3f}s"
+        msg += f", in flight {self.in_flight}, errors {self.errors}"
+        if self.eta is not None:
+            msg += f", ETA {self.eta:.0f}s"
+        return msg + ")"
+
+
+class ProgressMonitor:
+    """Collects pool metrics and reports them not more often than once per interval seconds
+
+    Args:
+        total (int, optional): count of inputs, if known
+        callback (function, optional): called with PoolStats on every report. Default - log stats
+        interval (float, optional): min seconds between reports
+        latency_window (int, optional): count of recent inputs for latency percentiles
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, total=None, callback=None, interval=5.0, latency_window=1000):
+        self.total = total
+        self.callback = callback
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._start = self._reported = time.monotonic()
+        self._lock = threading.Lock()
+
+    def started(self, count=1):
+        with self._lock:
+            self.in_flight += count
+
+    def finished(self, latency, is_ok=True):
+        with self._lock:
+            self.in_flight -= 1
+            if is_ok:
+                self.done += 1
+            else:
+                self.errors += 1
+            self._latencies.append(latency)
+        if time.monotonic() - self._reported >= self.interval:
+            self.report()
+
+    def stats(self):
+        with self._lock:
+            finished = self.done + self.errors
+            elapsed = time.monotonic() - self._start
+            throughput = finished / elapsed if elapsed > 0 else 0.0
+            latencies = sorted(self._latencies)
+            latency = {
+                q: latencies[min(len(latencies) - 1, len(latencies) * q // 100)]
+                for q in self.PERCENTILES
+                if latencies
+            }
+            eta = None
+            if self.total is not None and throughput > 0:
+                eta = (self.total - finished) / throughput
+            return PoolStats(
+                done=self.done,
+                errors=self.errors,
+                in_flight=self.in_flight,
+                total=self.total,
+                elapsed=elapsed,
+                throughput=throughput,
+                latency=latency,
+                eta=eta,
+                error_rate=self.errors / finished if finished else 0.0,
+            )
+
+    def report(self):
+        self._reported = time.monotonic()
+        stats = self.stats()
+        if self.callback:
+            self.callback(stats)
+        else:
+            logger.info(str(stats))
+
+
+class AdaptiveConcurrency:
+    """AIMD limit of concurrently running tasks for I/O-bound pools.
+    Limit grows by one per finished task while no congestion was seen (slow start),
+    then by one per limit finished tasks. On congestion it's multiplied by decrease.
+    Congestion is a throttle error (HTTP 429), error rate above max_error_rate
+    or recent latency longer than latency_tolerance times long-term latency.
+    After decrease new signals are ignored until limit tasks are finished
+
+    Args:
+        min_limit (int, optional): min count of concurrent tasks
+        max_limit (int, optional): max count of concurrent tasks, also pool size
+        initial (int, optional): start limit. Default - min(10, max_limit)
+        decrease (float, optional): limit multiplier on congestion
+        latency_tolerance (float, optional): ratio of recent latency to long-term latency treated as congestion
+        max_error_rate (float, optional): error rate (moving average) treated as congestion
+        throttle_errors (tuple, optional): exception types which mean "slow down".
+            Exceptions with status_code/status 429 (or response with it) are detected without this
+    """
+
+    SHORT_ALPHA = 0.3
+    LONG_ALPHA = 0.02
+    ERROR_ALPHA = 0.1
+    WARMUP = 20
+
+    def __init__(
+        self,
+        min_limit=1,
+        max_limit=100,
+        initial=None,
+        decrease=0.5,
+        latency_tolerance=2.0,
+        max_error_rate=0.2,
+        throttle_errors=(),
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.throttle_errors = tuple(throttle_errors)
+        initial = initial or min(10, max_limit)
+        self._limit = float(max(min_limit, min(max_limit, initial)))
+        self._slow_start = True
+        self._cooldown = 0
+        self._samples = 0
+        self._short_latency = self._long_latency = None
+        self._error_rate = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def is_throttle(self, exception):
+        if isinstance(exception, self.throttle_errors):
+            return True
+        for obj in (exception, getattr(exception, "response", None)):
+            status = getattr(obj, "status_code", None) or getattr(obj, "status", None)
+            if status == 429:
+                return True
+        return False
+
+    def update(self, latency, is_ok=True, exception=None):
+        """Feedback from finished task"""
+        with self._lock:
+            self._cooldown = max(0, self._cooldown - 1)
+            if not is_ok and self.is_throttle(exception):
+                self._congestion("throttled")
+                return
+            self._error_rate += self.ERROR_ALPHA * ((not is_ok) - self._error_rate)
+            if is_ok:
+                self._update_latency(latency)
+            if self._error_rate > self.max_error_rate:
+                self._congestion(f"error rate {self._error_rate:.2f}")
+            elif (
+                self._samples >= self.WARMUP
+                and self._short_latency > self._long_latency * self.latency_tolerance
+            ):
+                self._congestion(f"latency {self._short_latency:.3f}s")
+            else:
+                self._increase()
+
+    def throttled(self):
+        """Signal from outside of pool, e.g. 429 response, which was retried inside task"""
+        with self._lock:
+            self._congestion("throttled")
+
+    def _update_latency(self, latency):
+        self._samples += 1
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+            return
+        self._short_latency += self.SHORT_ALPHA * (latency - self._short_latency)
+        self._long_latency += self.LONG_ALPHA * (latency - self._long_latency)
+
+    def _increase(self):
+        step = 1 if self._slow_start else 1 / self._limit
+        self._limit = min(self.max_limit, self._limit + step)
+
+    def _congestion(self, reason):
+        self._slow_start = False
+        if self._cooldown:
+            return
+        self._limit = max(self.min_limit, self._limit * self.decrease)
+        self._cooldown = self.limit
+        logger.debug(f"Concurrency limit decreased to {self.limit} ({reason})")
+
+
+def _adaptive_concurrency(workers):
+    """AdaptiveConcurrency for workers="adaptive" or AdaptiveConcurrency, None for fixed count of workers"""
+    if workers == "adaptive":
+        return AdaptiveConcurrency()
+    if isinstance(workers, AdaptiveConcurrency):
+        return workers
+
+
+def _make_monitor(progress, total, interval):
+    if isinstance(progress, ProgressMonitor):
+        return progress
+    return ProgressMonitor(total, progress, interval)
+
+
+def _iter_tasks(inputs, done, chunksize):
+    """Groups not done (index, args) pairs of inputs into tasks"""
+    items = ((i, args) for i, args in enumerate(inputs) if i not in done)
+    if not chunksize:
+        for item in items:
+            yield [item]
+    elif isinstance(chunksize, AutoChunkSize):
+        while True:
+            chunk = list(islice(items, chunksize.size))
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from chunker(items, chunksize)
+
+
+def pool_iter(
+    func,
+    inputs,
+    workers=100,
+    pool_type="thread",
+    unpack_input=True,
+    ordered=True,
+    max_in_flight=None,
+    checkpoint=None,
+    errors="raise",
+    retries=0,
+    backoff=1.0,
+    chunksize=None,
+    initializer=None,
+    initargs=(),
+    progress=None,
+    progress_interval=5.0,
+):
+    """Streaming version of pool_execute: inputs are consumed lazily,
+    only max_in_flight tasks are submitted at once, results are yielded as generator
+
+    Args:
+        func (function): pool function
+        inputs (Iterable): args for function, any iterable (even infinite)
+        workers (int|str|AdaptiveConcurrency, optional): count of pool workers.
+            "adaptive" or AdaptiveConcurrency - count of running tasks is tuned by latency and errors (AIMD),
+            for I/O-bound work against rate limited services
+        pool_type (str, optional): pool type - thread or process
+        unpack_input (bool, optional): if true, will unpack list-like inputs in args. Else use input as is
+        ordered (bool, optional): if true, results are yielded in inputs order, else in completion order
+        max_in_flight (int, optional): max count of submitted but not yielded tasks (chunks).
+            Default is 2 * workers, or current limit for adaptive workers
+        checkpoint (str|pathlib.Path, optional): file to save indexes of yielded results.
+            When run again with the same file and inputs, already yielded inputs are skipped
+        errors (str, optional): what to do when func fails (after all retries):
+            raise - cancel not started tasks and raise exception,
+            collect - yield TaskError instead of result,
+            skip - log exception and yield nothing for this input
+        retries (int, optional): count of func retries on exception
+        backoff (float, optional): first pause between retries in seconds, doubles on each retry
+        chunksize (int|str, optional): send inputs to workers by chunks of this size.
+            "auto" - pick size from measured time of func (see AutoChunkSize).
+            Useful for process pool with small tasks, when pickling costs more than the work
+        initializer (function, optional): called once in every worker before tasks - to load heavy state once per worker,
+            e.g. initializer=reverse_geocoders.preload_layers or
+            initializer=importlib.import_module, initargs=("gis_tools.nlp",)
+        initargs (tuple, optional): args for initializer
+        progress (function|ProgressMonitor, optional): called with PoolStats (throughput, latency percentiles,
+            in flight count, ETA, error rate) not more often than once per progress_interval seconds
+            and once at the end. Default - log stats. Pass ProgressMonitor to read stats from outside
+        progress_interval (float, optional): min seconds between progress reports
+
+    Yields:
+        func results (or TaskError for errors="collect")
+
+    Raises:
+        TypeError: when use unknown type in pool_type
+    """
+    executor_class = _executor_class(pool_type)
+    _check_error_policy(errors)
+    concurrency = _adaptive_concurrency(workers)
+    if concurrency:
+        workers = concurrency.max_limit
+    max_in_flight = max_in_flight or 2 * workers
+    if chunksize == "auto":
+        chunksize = AutoChunkSize()
+    checkpoint = Checkpoint(checkpoint) if checkpoint else None
+    done = checkpoint.load() if checkpoint else set()
+    if done:
+        logger.info(f"Skip {len(done)} inputs from checkpoint")
+    total = len(inputs) - len(done) if hasattr(inputs, "__len__") else None
+    monitor = _make_monitor(progress, total, progress_interval)
+    executor = executor_class(
+        max_workers=workers, initializer=initializer, initargs=initargs
+    )
+    pending = {}
+    queue = deque()
+    try:
+        for task in _iter_tasks(inputs, done, chunksize):
+            chunk = [args for _, args in task]
+            future = executor.submit(
+                _call_chunk, func, chunk, unpack_input, retries, backoff
+            )
+            monitor.started(len(task))
+            pending[future] = task
+            if ordered:
+                queue.append(future)
+            while len(pending) >= _in_flight_limit(max_in_flight, concurrency):
+                yield from _pop_ready(
+                    pending,
+                    queue,
+                    ordered,
+                    checkpoint,
+                    errors,
+                    chunksize,
+                    monitor,
+                    concurrency,
+                )
+        while pending:
+            yield from _pop_ready(
+                pending,
+                queue,
+                ordered,
+                checkpoint,
+                errors,
+                chunksize,
+                monitor,
+                concurrency,
+            )
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if checkpoint:
+            checkpoint.close()
+        monitor.report()
+
+
+def _in_flight_limit(max_in_flight, concurrency):
+    if concurrency:
+        return min(max_in_flight, concurrency.limit)
+    return max_in_flight
+
+
+def _outcomes(future, task, chunksize):
+    """List of (is_ok, result or exception, seconds spent) for every input of task"""
+    try:
+        outcomes = future.result()
+    except Exception as e:
+        # task failed outside of func, e.g. result can't be pickled in process pool
+        return [(False, e, 0.0)] * len(task)
+    if isinstance(chunksize, AutoChunkSize):
+        chunksize.update(sum(elapsed for *_, elapsed in outcomes), len(outcomes))
+    return outcomes
+
+
+def _pop_ready(
+    pending, queue, ordered, checkpoint, errors, chunksize, monitor, concurrency
+):
+    """Yields results of completed tasks: first in queue for ordered mode, any of them otherwise"""
+    if ordered:
+        ready = [queue.popleft()]
+    else:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        # pending keeps submission order
+        ready = [future for future in pending if future in done]
+    for future in ready:
+        task = pending.pop(future)
+        outcomes = _outcomes(future, task, chunksize)
+        for (i, args), (is_ok, result, latency) in zip(task, outcomes):
+            monitor.finished(latency, is_ok)
+            if concurrency:
+                concurrency.update(latency, is_ok, None if is_ok else result)
+            if not is_ok:
+                if errors == "raise":
+                    raise result
+                logger.error(f"Error on args {args}", exc_info=result)
+                if errors == "collect":
+                    yield TaskError(i, args, result)
+                continue
+            yield result
+            if checkpoint:
+                checkpoint.mark(i)
+
+
+def pool_execute(
+    func,
+    inputs=None,
+    workers=100,
+    pool_type="thread",
+    unpack_input=True,
+    errors="raise",
+    retries=0,
+    backoff=1.0,
+    chunksize=None,
+    initializer=None,
+    initargs=(),
+    progress=None,
+    progress_interval=5.0,
+):
     """Simple use of python threading pool
 
     Args:
         func (function): pool function
         inputs (None, optional): args for function
-        workers (int, optional): count of pool workers
+        workers (int|str|AdaptiveConcurrency, optional): count of pool workers or "adaptive". See pool_iter
         pool_type (str, optional): pool type - thread or process
         unpack_input (bool, optional): if true, will unpack list-like inputs in args. Else use input as is
+        errors (str, optional): raise, collect or skip - see pool_iter.
+            With raise, already finished results are available in exception.partial_results
+        retries (int, optional): count of func retries on exception
+        backoff (float, optional): first pause between retries in seconds, doubles on each retry
+        chunksize (int|str, optional): send inputs to workers by chunks, "auto" - pick size by measured time. See pool_iter
+        initializer (function, optional): called once in every worker before tasks. See pool_iter
+        initargs (tuple, optional): args for initializer
+        progress (function|ProgressMonitor, optional): progress callback. See pool_iter
+        progress_interval (float, optional): min seconds between progress reports
 
     Returns:
-        list: func results
+        PoolResults: func results in completion order, failed inputs in .errors (for errors="collect")
 
     Raises:
         TypeError: when use unknown type in pool_type
     """
     logger.debug("Start pool_execute...")
     if not inputs:
-        return []
-    if pool_type == "thread":
-        p_executor = ThreadPoolExecutor
-    elif pool_type == "process":
-        p_executor = ProcessPoolExecutor
-    else:
-        raise TypeError(f"Неверный параметр pool_type={pool_type}")
-    with p_executor(max_workers=workers) as executor:
-        inputs = list(inputs)
-        example = inputs[0]
-        if (isinstance(example, list) or isinstance(example, tuple)) and unpack_input:
-            futures = {executor.submit(func, *args): args for args in inputs}
-        elif isinstance(example, dict) and unpack_input:
-            futures = {executor.submit(func, **args): args for args in inputs}
-        else:
-            futures = {executor.submit(func, args): args for args in inputs}
-        result = []
-        for f in as_completed(futures):
-            try:
-                result.append(f.result())
-            except Exception as e:
-                raise e
+        return PoolResults()
+    inputs = list(inputs)
+    result = PoolResults()
+    try:
+        for r in pool_iter(
+            func,
+            inputs,
+            workers=workers,
+            pool_type=pool_type,
+            unpack_input=unpack_input,
+            ordered=False,
+            errors=errors,
+            retries=retries,
+            backoff=backoff,
+            chunksize=chunksize,
+            initializer=initializer,
+            initargs=initargs,
+            progress=progress,
+            progress_interval=progress_interval,
+        ):
+            if isinstance(r, TaskError):
+                result.errors[r.index] = r
             else:
-                logger.info(f"Done {len(result)} out {len(futures)}")
+                result.append(r)
+    except Exception as e:
+        logger.error(f"pool_execute failed, {len(result)} results are done")
+        e.partial_results = result
+        raise
     return result
 
 
-def loop_execute(func, inputs=None, unpack_input=True, **kwargs):
-    """Same as pool_execute, but it doesn't use threading or multiprocessing - just iterate inputs"""
+def loop_execute(
+    func,
+    inputs=None,
+    unpack_input=True,
+    errors="stop",
+    retries=0,
+    backoff=1.0,
+    progress=None,
+    progress_interval=5.0,
+    **kwargs,
+):
+    """Same as pool_execute, but it doesn't use threading or multiprocessing - just iterate inputs
+
+    Args:
+        errors (str, optional): stop (log exception and return done results), raise, collect or skip - see pool_iter
+        progress (function|ProgressMonitor, optional): progress callback. See pool_iter
+        progress_interval (float, optional): min seconds between progress reports
+    """
+    _check_error_policy(errors, ERROR_POLICIES + ("stop",))
+    results = PoolResults()
     if not inputs:
-        return []
-    results = []
-    for i, item in enumerate(inputs):
-        try:
-            if (isinstance(item, list) or isinstance(item, tuple)) and unpack_input:
-                result = func(*item)
-            elif isinstance(item, dict) and unpack_input:
-                result = func(**item)
-            else:
-                result = func(item)
+        return results
+    total = len(inputs) if hasattr(inputs, "__len__") else None
+    monitor = _make_monitor(progress, total, progress_interval)
+    try:
+        for i, item in enumerate(inputs):
+            monitor.started()
+            start = time.perf_counter()
+            try:
+                result = _call(func, item, unpack_input, retries, backoff)
+            except Exception as e:
+                monitor.finished(time.perf_counter() - start, is_ok=False)
+                if errors == "raise":
+                    e.partial_results = results
+                    raise
+                logger.exception(f"FATAL ERROR on args {item}")
+                if errors == "stop":
+                    return results
+                elif errors == "collect":
+                    results.errors[i] = TaskError(i, item, e)
+                continue
+            monitor.finished(time.perf_counter() - start)
             results.append(result)
-            logger.info(f"Done {i+1} out {len(inputs)}")
-        except:
-            logger.exception(f"FATAL ERROR on args {item}")
-            return results
+    finally:
+        monitor.report()
     return results
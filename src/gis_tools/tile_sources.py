@@ -0,0 +1,221 @@
+import inspect
+import logging
+from urllib.parse import urlencode
+
+from .http_utils import ClientSession
+
+logger = logging.getLogger(__name__)
+
+
+class TileSource:
+    """Протокол источника тайлов GeoTiffer.
+
+    Синхронный источник определяет fetch(bounds, tile, client), где client - общий для всех потоков
+    http_utils.HttpClient (пул соединений, повторы при 429, ограничение частоты запросов по хостам).
+    Асинхронный источник (is_async = True) определяет корутину fetch_async(bounds, tile, client),
+    где client - общий http_utils.AsyncHttpClient. tile - атрибуты тайла из сетки (например, x, y, z от tiles_over_shape).
+    Оба метода возвращают bytes тайла или None, если тайла нет
+    """
+
+    is_async = False
+
+    def fetch(self, bounds, tile, client):
+        raise NotImplementedError
+
+    async def fetch_async(self, bounds, tile, client):
+        raise NotImplementedError
+
+
+class CallableSource(TileSource):
+    """Источник из функции download_handler(bounds, **kwargs) - прежний интерфейс GeoTiffer.
+    Функция может быть корутиной. Если у нее есть аргумент session, в него передается общая сессия:
+    для обычной функции - http_utils.ClientSession, запросы которой проходят через ограничение частоты
+    и повторы при 429 клиента, для корутины - aiohttp.ClientSession без них
+    """
+
+    def __init__(self, handler, options=None):
+        self.handler = handler
+        self.options = options or {}
+        self.is_async = inspect.iscoroutinefunction(handler)
+        self.takes_session = "session" in inspect.signature(handler).parameters
+
+    @property
+    def uses_client(self):
+        """Проходят ли запросы функции через ограничение частоты и повторы при 429 клиента"""
+        return self.takes_session and not self.is_async
+
+    def _kwargs(self, client):
+        if not self.takes_session:
+            return self.options
+        session = client.session if self.is_async else ClientSession(client)
+        return {"session": session, **self.options}
+
+    def fetch(self, bounds, tile, client):
+        return self.handler(bounds, **self._kwargs(client))
+
+    async def fetch_async(self, bounds, tile, client):
+        return await self.handler(bounds, **self._kwargs(client))
+
+
+def as_tile_source(handler, options=None):
+    """Приводит download_handler GeoTiffer к TileSource"""
+    if isinstance(handler, TileSource):
+        if options:
+            raise ValueError("download_options не используются с TileSource")
+        return handler
+    return CallableSource(handler, options)
+
+
+class TileSourceError(Exception):
+    """Ошибка ответа сервера тайлов. status_code позволяет AdaptiveConcurrency распознать 429"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UrlTileSource(TileSource):
+    """Источник тайлов по HTTP GET. Наследники определяют url(bounds, tile)"""
+
+    def __init__(
+        self, headers=None, timeout=30, empty_statuses=(204, 404), asynchronous=False
+    ):
+        """
+        Args:
+            headers (dict, optional): заголовки запросов
+            timeout (float, optional): таймаут запроса в секундах
+            empty_statuses (tuple, optional): статусы ответа, которые означают отсутствие тайла
+            asynchronous (bool, optional): скачивать через aiohttp (см. http_utils.AsyncHttpClient)
+        """
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.empty_statuses = tuple(empty_statuses)
+        self.is_async = asynchronous
+
+    def url(self, bounds, tile):
+        raise NotImplementedError
+
+    def _content(self, url, status, content):
+        if status in self.empty_statuses:
+            return None
+        if status >= 400:
+            raise TileSourceError(f"{url}: HTTP {status}", status)
+        return content or None
+
+    def fetch(self, bounds, tile, client):
+        url = self.url(bounds, tile)
+        r = client.get(url, headers=self.headers, timeout=self.timeout)
+        return self._content(url, r.status_code, r.content)
+
+    async def fetch_async(self, bounds, tile, client):
+        import aiohttp
+
+        url = self.url(bounds, tile)
+        status, content = await client.get(
+            url,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self._content(url, status, content)
+
+
+class XYZSource(UrlTileSource):
+    """Slippy-тайлы по шаблону URL, например "https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png".
+    Поддерживаются {x}, {y}, {z}, {-y} (строка в схеме TMS) и {s} - поддомен, выбирается по тайлу.
+    Сетка должна содержать колонки x, y, z (см. geo_utils.tiles_over_shape)
+    """
+
+    def __init__(self, template, subdomains="abc", **kwargs):
+        """
+        Args:
+            template (str): шаблон URL
+            subdomains (str|list, optional): поддомены для {s}
+            **kwargs: аргументы UrlTileSource
+        """
+        super().__init__(**kwargs)
+        self.template = template
+        self.subdomains = list(subdomains)
+
+    def url(self, bounds, tile):
+        try:
+            x, y, z = int(tile["x"]), int(tile["y"]), int(tile["z"])
+        except KeyError as e:
+            raise ValueError(
+                "Для XYZSource сетка должна содержать колонки x, y, z"
+            ) from e
+        # подстановка через replace, т.к. {-y} не является корректным полем str.format
+        values = {
+            "{x}": x,
+            "{y}": y,
+            "{z}": z,
+            "{-y}": (1 << z) - 1 - y,
+            "{s}": self.subdomains[(x + y) % len(self.subdomains)],
+        }
+        url = self.template
+        for field, value in values.items():
+            url = url.replace(field, str(value))
+        return url
+
+
+class WMSSource(UrlTileSource):
+    """Тайлы WMS GetMap по границам тайла сетки"""
+
+    def __init__(
+        self,
+        url,
+        layers,
+        crs="EPSG:3857",
+        width=256,
+        height=256,
+        image_format="image/png",
+        styles="",
+        version="1.3.0",
+        params=None,
+        **kwargs,
+    ):
+        """
+        Args:
+            url (str): адрес WMS-сервиса
+            layers (str): слои через запятую
+            crs (str, optional): CRS сетки тайлов
+            width (int, optional): ширина тайла в пикселях
+            height (int, optional): высота тайла в пикселях
+            image_format (str, optional): формат изображения
+            styles (str, optional): стили слоев
+            version (str, optional): версия WMS
+            params (dict, optional): дополнительные параметры запроса (например, TRANSPARENT)
+            **kwargs: аргументы UrlTileSource
+        """
+        super().__init__(**kwargs)
+        self.base_url = url
+        self.layers = layers
+        self.crs = crs
+        self.width = width
+        self.height = height
+        self.image_format = image_format
+        self.styles = styles
+        self.version = version
+        self.params = params or {}
+
+    def url(self, bounds, tile):
+        minx, miny, maxx, maxy = bounds
+        # в WMS 1.3.0 для EPSG:4326 порядок осей - широта, долгота
+        if self.version == "1.3.0" and self.crs.upper() == "EPSG:4326":
+            bbox = (miny, minx, maxy, maxx)
+        else:
+            bbox = (minx, miny, maxx, maxy)
+        params = {
+            "SERVICE": "WMS",
+            "REQUEST": "GetMap",
+            "VERSION": self.version,
+            "LAYERS": self.layers,
+            "STYLES": self.styles,
+            "CRS" if self.version == "1.3.0" else "SRS": self.crs,
+            "BBOX": ",".join(str(v) for v in bbox),
+            "WIDTH": self.width,
+            "HEIGHT": self.height,
+            "FORMAT": self.image_format,
+            **self.params,
+        }
+        separator = "&" if "?" in self.base_url else "?"
+        return self.base_url + separator + urlencode(params)
@@ -0,0 +1,272 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STATUS_DONE = "done"
+STATUS_EMPTY = "empty"
+STATUS_FAILED = "failed"
+# тайлы с такими статусами повторно не скачиваются, пока не устареют
+FINAL_STATUSES = (STATUS_DONE, STATUS_EMPTY)
+
+
+def _hash(obj, length):
+    raw = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:length]
+
+
+def tile_key(bounds):
+    """Ключ тайла в хранилище - хэш его границ. Не зависит от порядка тайлов в сетке,
+    поэтому при расширении сетки уже скачанные тайлы находятся по тому же ключу
+
+    Args:
+        bounds (tuple): границы тайла (minx, miny, maxx, maxy)
+
+    Returns:
+        str:
+    """
+    return _hash([round(float(b), 9) for b in bounds], 16)
+
+
+class UnstableHandlerError(ValueError):
+    """Состояние обработчика нельзя надежно хэшировать, нужен явный ключ хранилища"""
+
+
+def _code_state(code):
+    """Байт-код функции вместе с константами и именами: отличает лямбды и замыкания с одним qualname.
+    Байт-код зависит от версии Python, поэтому после смены минорной версии ключ меняется
+    и тайлы инкрементального режима скачиваются заново
+    """
+    return [
+        code.co_code.hex(),
+        [
+            _code_state(c) if inspect.iscode(c) else _stable_state(c, set())
+            for c in code.co_consts
+        ],
+        list(code.co_names),
+    ]
+
+
+def _is_immutable(value):
+    if value is None or value is Ellipsis:
+        return True
+    if isinstance(value, (bool, int, float, complex, str, bytes)):
+        return True
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_immutable(v) for v in value)
+    return False
+
+
+def _captured_state(values, seen):
+    """Значения замыкания и аргументов по умолчанию функции. В ключ входят неизменяемые скаляры
+    и ссылки на функции, классы и модули. Изменяемые объекты (журнал вызовов, счетчик, кэш, конфиг)
+    представлены только типом: их содержимое меняется во время работы и ключ не должен от него зависеть
+    """
+    state = []
+    for value in values or ():
+        if _is_immutable(value) or callable(value) or inspect.ismodule(value):
+            state.append(_stable_state(value, seen))
+        else:
+            state.append(f"mutable:{type(value).__qualname__}")
+    return state
+
+
+def _stable_state(obj, seen):
+    """Приводит обработчик или его аргумент к JSON-совместимому виду, одинаковому между запусками.
+    Не поддерживаемые объекты (сессии, соединения, объекты без атрибутов) вызывают UnstableHandlerError:
+    их repr содержит адрес в памяти и ключ был бы случайным
+    """
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if obj is Ellipsis or isinstance(obj, complex):
+        return repr(obj)
+    if isinstance(obj, bytes):
+        return obj.hex()
+    if isinstance(obj, (list, tuple)):
+        return [_stable_state(v, seen) for v in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted(json.dumps(_stable_state(v, seen), sort_keys=True) for v in obj)
+    if isinstance(obj, dict):
+        return {str(k): _stable_state(v, seen) for k, v in obj.items()}
+    if inspect.ismodule(obj):
+        return f"module:{obj.__name__}"
+    if isinstance(obj, type):
+        return f"class:{obj.__module__}.{obj.__qualname__}"
+    # рекурсивные замыкания и ссылки объектов друг на друга
+    if id(obj) in seen:
+        return f"ref:{type(obj).__qualname__}"
+    seen = seen | {id(obj)}
+    if isinstance(obj, functools.partial):
+        return [
+            "partial",
+            _stable_state(obj.func, seen),
+            _stable_state(obj.args, seen),
+            _stable_state(obj.keywords, seen),
+        ]
+    if inspect.ismethod(obj):
+        return [
+            "method",
+            _stable_state(obj.__func__, seen),
+            _stable_state(obj.__self__, seen),
+        ]
+    if inspect.isfunction(obj):
+        closure = [cell.cell_contents for cell in obj.__closure__ or ()]
+        kwdefaults = sorted((obj.__kwdefaults__ or {}).items())
+        return [
+            f"{obj.__module__}.{obj.__qualname__}",
+            _code_state(obj.__code__),
+            _captured_state(closure, seen),
+            _captured_state(obj.__defaults__, seen),
+            [name for name, _ in kwdefaults],
+            _captured_state([value for _, value in kwdefaults], seen),
+        ]
+    if inspect.isbuiltin(obj):
+        return f"builtin:{getattr(obj, '__module__', None)}.{obj.__qualname__}"
+    # объекты-источники (см. tile_sources): шаблон URL, слои и т.п.
+    state = getattr(obj, "__dict__", None)
+    if state is not None:
+        return [
+            f"{type(obj).__module__}.{type(obj).__qualname__}",
+            _stable_state(state, seen),
+        ]
+    raise UnstableHandlerError(
+        f"Не удалось получить стабильный ключ для {type(obj).__qualname__}, "
+        "передайте ключ хранилища явно (GeoTiffer store_key)"
+    )
+
+
+def handler_key(handler, options=None):
+    """Хэш обработчика скачивания и его аргументов. Тайлы разных обработчиков
+    (или одного обработчика с разными аргументами) хранятся в разных папках.
+    В ключ входят модуль, qualname и байт-код функции, неизменяемые значения ее замыкания,
+    func/args/keywords у functools.partial, options и атрибуты объектов-источников.
+    Изменяемое состояние в замыкании в ключ не входит: обработчики, которые отличаются только им,
+    должны передавать store_key
+
+    Args:
+        handler (function|tile_sources.TileSource): обработчик скачивания тайла
+        options (dict, optional): аргументы обработчика
+
+    Raises:
+        UnstableHandlerError: аргументы или атрибуты обработчика нельзя хэшировать (например, сессия),
+            в этом случае ключ хранилища нужно передать явно (см. GeoTiffer store_key)
+
+    Returns:
+        str:
+    """
+    state = _stable_state([handler, options or {}], set())
+    return _hash(state, 12)
+
+
+class TileStore:
+    """Постоянное хранилище скачанных тайлов с манифестом.
+    Байты тайлов лежат в folder/<ключ тайла>, манифест - в folder/manifest.sqlite:
+    для каждого тайла статус (done, empty, failed), индекс в сетке, время обновления и текст ошибки
+    """
+
+    def __init__(self, folder, max_age=None):
+        """
+        Args:
+            folder (str|pathlib.Path): папка хранилища
+            max_age (float, optional): время жизни тайла в секундах, после которого он скачивается заново. None - бессрочно
+        """
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.folder / "manifest.sqlite"), check_same_thread=False
+        )
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles ("
+                "key TEXT PRIMARY KEY, tile_index INTEGER, status TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, error TEXT)"
+            )
+
+    def path(self, key):
+        return self.folder / key
+
+    def statuses(self):
+        """Актуальные статусы тайлов: устаревшие записи не возвращаются
+
+        Returns:
+            dict: {ключ тайла: статус}
+        """
+        query = "SELECT key, status FROM tiles"
+        params = ()
+        if self.max_age is not None:
+            query += " WHERE updated_at >= ?"
+            params = (time.time() - self.max_age,)
+        with self._lock:
+            return dict(self._conn.execute(query, params).fetchall())
+
+    def split(self, tiles):
+        """Делит тайлы на уже скачанные и те, которые нужно скачать: новые, устаревшие и упавшие в прошлый раз.
+        Пустые тайлы (STATUS_EMPTY) не попадают ни в одну из групп
+
+        Args:
+            tiles (Iterable[tuple]): пары (индекс, геометрия тайла)
+
+        Returns:
+            tuple(list, list): пары (индекс, геометрия) скачанных и недостающих тайлов в исходном порядке
+        """
+        statuses = self.statuses()
+        done, missing = [], []
+        for index, geom in tiles:
+            status = statuses.get(tile_key(geom.bounds))
+            if status == STATUS_DONE:
+                done.append((index, geom))
+            elif status not in FINAL_STATUSES:
+                missing.append((index, geom))
+        return done, missing
+
+    def put(self, key, index, data):
+        """Сохраняет байты тайла (или отметку о пустом тайле, если data пустые)"""
+        if data:
+            path = self.path(key)
+            tmp_path = path.with_name(f"{key}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        self._mark(key, index, STATUS_DONE if data else STATUS_EMPTY)
+
+    def fail(self, key, index, error):
+        self._mark(key, index, STATUS_FAILED, repr(error))
+
+    def _mark(self, key, index, status, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tiles (key, tile_index, status, updated_at, error) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, index, status, time.time(), error),
+            )
+
+    def report(self, keys=None):
+        """Количество тайлов по статусам
+
+        Args:
+            keys (Iterable[str], optional): считать только эти тайлы (например, тайлы текущей сетки).
+                Тайлы без записи в манифесте считаются как missing
+
+        Returns:
+            dict: {статус: количество}
+        """
+        statuses = self.statuses()
+        if keys is None:
+            return dict(Counter(statuses.values()))
+        return dict(Counter(statuses.get(key, "missing") for key in keys))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
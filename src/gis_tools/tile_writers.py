@@ -0,0 +1,365 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def gdal_config(options):
+    """Временно задает конфигурационные опции GDAL (GDAL_CACHEMAX, GDAL_NUM_THREADS и т.п.)"""
+    from osgeo import gdal
+
+    old = {key: gdal.GetConfigOption(key) for key in options}
+    for key, value in options.items():
+        gdal.SetConfigOption(key, str(value))
+    try:
+        yield
+    finally:
+        for key, value in old.items():
+            gdal.SetConfigOption(key, value)
+
+
+def georeference_tile(tile_path, bounds, crs, vsimem_folder):
+    """Привязывает тайл по известным границам: VRT в памяти, который ссылается на файл тайла,
+    пиксели при этом не копируются
+
+    Args:
+        tile_path (pathlib.Path): файл тайла
+        bounds (tuple): границы тайла (minx, miny, maxx, maxy)
+        crs (str): CRS границ
+        vsimem_folder (str): папка в /vsimem/ для VRT
+
+    Returns:
+        str: путь к VRT в /vsimem/
+    """
+    from osgeo import gdal
+
+    vrt_path = f"{vsimem_folder}/{tile_path.name}.vrt"
+    ds = gdal.Translate(
+        vrt_path,
+        str(tile_path),
+        format="VRT",
+        outputSRS=crs,
+        outputBounds=[bounds[0], bounds[3], bounds[2], bounds[1]],
+    )
+    if ds is None:
+        raise RuntimeError(f"Не удалось привязать тайл {tile_path}")
+    ds = None
+    return vrt_path
+
+
+class TileWriter:
+    """Интерфейс записи результата GeoTiffer.
+    open вызывается перед обработкой тайлов, write - для каждого готового тайла сетки
+    (из потоков скачивания сразу после сохранения тайла, поэтому должен быть потокобезопасным),
+    close собирает результат. Если обработка упала, вместо close вызывается abort
+    """
+
+    def open(self, output_path, grid):
+        """
+        Args:
+            output_path (pathlib.Path): путь к результату
+            grid (geopandas.GeoDataFrame): сетка тайлов со всеми колонками исходного датасета
+        """
+        raise NotImplementedError
+
+    def write(self, tile_index, tile_geom, tile_path):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        pass
+
+
+class GeoTiffWriter(TileWriter):
+    """Мозаика через VRT: тайлы привязываются в /vsimem/ по мере готовности,
+    мозаика собирается gdal.BuildVRT, итоговый файл пишется одним gdal.Translate при close
+    """
+
+    FORMAT = "GTiff"
+    CREATION_OPTIONS = [
+        "COMPRESS=JPEG",
+        "TILED=YES",
+        "BIGTIFF=IF_SAFER",
+        "NUM_THREADS=ALL_CPUS",
+    ]
+    # кэш блоков в МБ и потоки чтения/сжатия
+    GDAL_CONFIG = {"GDAL_CACHEMAX": 1024, "GDAL_NUM_THREADS": "ALL_CPUS"}
+
+    def __init__(self, creation_options=None, gdal_config=None):
+        """
+        Args:
+            creation_options (list, optional): опции драйвера, по умолчанию CREATION_OPTIONS
+            gdal_config (dict, optional): конфигурация GDAL на время записи, по умолчанию GDAL_CONFIG
+        """
+        self.creation_options = creation_options or self.CREATION_OPTIONS
+        self.gdal_config = gdal_config or self.GDAL_CONFIG
+
+    def open(self, output_path, grid):
+        self.output_path = output_path
+        self.crs = str(grid.crs)
+        self._vsimem_folder = f"/vsimem/gis_tools_{uuid.uuid4().hex}"
+        self._tiles = []
+        self._lock = threading.Lock()
+
+    def write(self, tile_index, tile_geom, tile_path):
+        vrt_path = georeference_tile(
+            tile_path, tile_geom.bounds, self.crs, self._vsimem_folder
+        )
+        with self._lock:
+            self._tiles.append((tile_index, vrt_path))
+
+    def close(self):
+        from osgeo import gdal
+
+        try:
+            with gdal_config(self.gdal_config):
+                tiles = [path for _, path in sorted(self._tiles, key=lambda t: t[0])]
+                mosaic = gdal.BuildVRT(f"{self._vsimem_folder}/mosaic.vrt", tiles)
+                if mosaic is None:
+                    raise RuntimeError("Не удалось собрать мозаику тайлов")
+                ds = gdal.Translate(
+                    str(self.output_path),
+                    mosaic,
+                    format=self.FORMAT,
+                    creationOptions=self.creation_options,
+                )
+                if ds is None:
+                    raise RuntimeError(f"Не удалось записать {self.output_path}")
+                ds = None
+                mosaic = None
+        finally:
+            self.abort()
+
+    def abort(self):
+        from osgeo import gdal
+
+        gdal.RmdirRecursive(self._vsimem_folder)
+
+
+class WindowedGeoTiffWriter(TileWriter):
+    """Потоковая запись: итоговый tiled GeoTIFF создается на весь экстент сетки при первом тайле
+    (разрешение, количество каналов и тип данных берутся из него), каждый тайл сразу
+    записывается в свое окно. Память ограничена размером тайла и кэшем блоков GDAL, а не размером результата.
+    Если размер тайла в пикселях кратен 16, блок файла равен тайлу и тайлы сетки пишутся целыми блоками
+    """
+
+    CREATION_OPTIONS = [
+        "COMPRESS=DEFLATE",
+        "PREDICTOR=2",
+        "TILED=YES",
+        "SPARSE_OK=TRUE",
+        "BIGTIFF=IF_SAFER",
+        "NUM_THREADS=ALL_CPUS",
+    ]
+    GDAL_CONFIG = {"GDAL_CACHEMAX": 256}
+
+    def __init__(
+        self,
+        creation_options=None,
+        gdal_config=None,
+        overviews=False,
+        overview_levels=(2, 4, 8, 16, 32),
+        overview_resampling="AVERAGE",
+    ):
+        """
+        Args:
+            creation_options (list, optional): опции драйвера GTiff, по умолчанию CREATION_OPTIONS
+            gdal_config (dict, optional): конфигурация GDAL на время записи, по умолчанию GDAL_CONFIG
+            overviews (bool, optional): построить внутренние обзоры (пирамиды) при close
+            overview_levels (tuple, optional): уровни обзоров
+            overview_resampling (str, optional): метод передискретизации обзоров
+        """
+        self.creation_options = creation_options or self.CREATION_OPTIONS
+        self.gdal_config = gdal_config or self.GDAL_CONFIG
+        self.overviews = overviews
+        self.overview_levels = list(overview_levels)
+        self.overview_resampling = overview_resampling
+
+    def open(self, output_path, grid):
+        self.output_path = output_path
+        self.crs = str(grid.crs)
+        self.bounds = grid.total_bounds
+        self._ds = None
+        self._lock = threading.Lock()
+        self._config = gdal_config(self.gdal_config)
+        self._config.__enter__()
+
+    def _create(self, src, tile_geom):
+        from osgeo import gdal, osr
+
+        minx, miny, maxx, maxy = tile_geom.bounds
+        self.xres = (maxx - minx) / src.RasterXSize
+        self.yres = (maxy - miny) / src.RasterYSize
+        x0, y0, x1, y1 = self.bounds
+        width = math.ceil(round((x1 - x0) / self.xres, 6))
+        height = math.ceil(round((y1 - y0) / self.yres, 6))
+        options = list(self.creation_options)
+        if src.RasterXSize % 16 == 0 and src.RasterYSize % 16 == 0:
+            options += [
+                f"BLOCKXSIZE={src.RasterXSize}",
+                f"BLOCKYSIZE={src.RasterYSize}",
+            ]
+        band = src.GetRasterBand(1)
+        ds = gdal.GetDriverByName("GTiff").Create(
+            str(self.output_path),
+            width,
+            height,
+            src.RasterCount,
+            band.DataType,
+            options=options,
+        )
+        if ds is None:
+            raise RuntimeError(f"Не удалось создать {self.output_path}")
+        ds.SetGeoTransform((x0, self.xres, 0, y1, 0, -self.yres))
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(self.crs)
+        ds.SetProjection(srs.ExportToWkt())
+        for i in range(1, src.RasterCount + 1):
+            ds.GetRasterBand(i).SetColorInterpretation(
+                src.GetRasterBand(i).GetColorInterpretation()
+            )
+        logger.info(f"Created {self.output_path}: {width}x{height}")
+        return ds
+
+    def write(self, tile_index, tile_geom, tile_path):
+        from osgeo import gdal
+
+        src = gdal.Open(str(tile_path))
+        if src is None:
+            raise RuntimeError(f"Не удалось открыть тайл {tile_path}")
+        with self._lock:
+            if self._ds is None:
+                self._ds = self._create(src, tile_geom)
+            ds = self._ds
+        minx, miny, maxx, maxy = tile_geom.bounds
+        x0, _, _, y1 = self.bounds
+        xoff = round((minx - x0) / self.xres)
+        yoff = round((y1 - maxy) / self.yres)
+        # тайл приводится к разрешению результата, если его разрешение отличается от первого тайла
+        xsize = round((maxx - minx) / self.xres)
+        ysize = round((maxy - miny) / self.yres)
+        data = src.ReadAsArray(buf_xsize=xsize, buf_ysize=ysize)
+        src = None
+        if data.ndim == 2:
+            data = data[None]
+        data = data[:, : ds.RasterYSize - yoff, : ds.RasterXSize - xoff]
+        with self._lock:
+            for i in range(min(len(data), ds.RasterCount)):
+                ds.GetRasterBand(i + 1).WriteArray(data[i], xoff, yoff)
+
+    def close(self):
+        try:
+            if self._ds is None:
+                raise RuntimeError("Нет ни одного тайла для записи")
+            if self.overviews:
+                self._ds.BuildOverviews(self.overview_resampling, self.overview_levels)
+            self._ds.FlushCache()
+            self._ds = None
+        finally:
+            self._config.__exit__(None, None, None)
+
+    def abort(self):
+        self._ds = None
+        self._config.__exit__(None, None, None)
+
+
+class COGWriter(GeoTiffWriter):
+    """Cloud-Optimized GeoTIFF с внутренними обзорами для чтения по HTTP range-запросам.
+    Пишется драйвером COG напрямую из VRT-мозаики тайлов, без промежуточного GeoTIFF
+    """
+
+    FORMAT = "COG"
+    CREATION_OPTIONS = [
+        "COMPRESS=JPEG",
+        "OVERVIEWS=AUTO",
+        "BIGTIFF=IF_SAFER",
+        "NUM_THREADS=ALL_CPUS",
+    ]
+
+
+class MBTilesWriter(TileWriter):
+    """Пакет slippy-тайлов MBTiles: байты тайлов записываются как есть, без перекодирования.
+    Сетка должна содержать колонки x, y, z (см. geo_utils.tiles_over_shape).
+    Файл собирается во временном пути и переименовывается при close.
+    PMTiles можно получить из результата конвертацией (например, `pmtiles convert`)
+    """
+
+    # сигнатуры форматов тайлов для metadata.format
+    FORMATS = {b"\x89PNG": "png", b"\xff\xd8\xff": "jpg", b"RIFF": "webp"}
+
+    def __init__(self, name=None, metadata=None):
+        """
+        Args:
+            name (str, optional): имя набора, по умолчанию имя файла
+            metadata (dict, optional): дополнительные поля таблицы metadata (attribution, description и т.п.)
+        """
+        self.name = name
+        self.metadata = metadata or {}
+
+    def open(self, output_path, grid):
+        if not {"x", "y", "z"}.issubset(grid.columns):
+            raise ValueError(
+                "Для MBTiles сетка должна содержать колонки x, y, z (см. tiles_over_shape)"
+            )
+        self.output_path = Path(output_path)
+        self._tmp_path = self.output_path.with_name(self.output_path.name + ".tmp")
+        self._tmp_path.unlink(missing_ok=True)
+        # номера тайлов ищутся по позиции индекса тайла в сетке
+        self._index = grid.index
+        self._xyz = grid[["x", "y", "z"]].to_numpy(dtype=np.int64)
+        self._metadata = {
+            "name": self.name or self.output_path.stem,
+            "type": "baselayer",
+            "version": "1.1",
+            "bounds": ",".join(str(b) for b in grid.to_crs(4326).total_bounds),
+            "minzoom": str(int(grid["z"].min())),
+            "maxzoom": str(int(grid["z"].max())),
+            **self.metadata,
+        }
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self._tmp_path), check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE metadata (name TEXT, value TEXT);"
+            "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+            "tile_row INTEGER, tile_data BLOB);"
+            "CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);"
+        )
+
+    def write(self, tile_index, tile_geom, tile_path):
+        x, y, z = self._xyz[self._index.get_loc(tile_index)].tolist()
+        data = tile_path.read_bytes()
+        with self._lock:
+            if "format" not in self._metadata:
+                self._metadata["format"] = next(
+                    (f for sig, f in self.FORMATS.items() if data.startswith(sig)),
+                    "png",
+                )
+            # в MBTiles строки тайлов считаются снизу (схема TMS)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                (z, x, (1 << z) - 1 - y, data),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO metadata VALUES (?, ?)", self._metadata.items()
+            )
+            self._conn.commit()
+            self._conn.close()
+        os.replace(self._tmp_path, self.output_path)
+
+    def abort(self):
+        self._conn.close()
+        self._tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,95 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from gis_tools import geocoders, geocoding_cache
+from gis_tools.tile_writers import TileWriter
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """HERE-подобный сервер: на каждый новый адрес сначала отвечает 429.
+    На адрес "unauthorized" отвечает 401 с ошибкой вместо items
+    """
+
+    seen = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)["q"][0]
+        if query not in self.seen:
+            self.seen.append(query)
+            self.send_response(429)
+            self.end_headers()
+            return
+        self.seen.append(query)
+        status = 200
+        items = []
+        if query != "nowhere":
+            items = [{"position": {"lng": len(query), "lat": 1}, "scoring": {}}]
+        body = json.dumps({"items": items}).encode()
+        if query == "unauthorized":
+            status = 401
+            body = json.dumps({"error": "Unauthorized"}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    """Запускает локальные HTTP-серверы: stub_server(handler_class) возвращает адрес сервера"""
+    servers = []
+
+    def start(handler_class):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def here_stub(monkeypatch, stub_server):
+    StubHandler.seen = []
+    url = stub_server(StubHandler)
+    monkeypatch.setenv("HERE_API_KEY", "test")
+    monkeypatch.setattr(geocoders, "HERE_GEOCODE_URL", url + "/")
+    monkeypatch.setattr(geocoding_cache, "_BACKEND", geocoding_cache.MemoryCache())
+    return StubHandler
+
+
+class RecordingWriter(TileWriter):
+    """Writer, который запоминает байты тайлов в памяти.
+    Тайлы с индексами из reject отклоняются по одному разу
+    """
+
+    def __init__(self):
+        self.reject = set()
+
+    def open(self, output_path, grid):
+        self.tiles = {}
+        self.closed = False
+
+    def write(self, tile_index, tile_geom, tile_path):
+        if tile_index in self.reject:
+            self.reject.discard(tile_index)
+            raise ValueError(f"Can't decode tile {tile_index}")
+        self.tiles[tile_index] = tile_path.read_bytes()
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def recording_writer():
+    return RecordingWriter()
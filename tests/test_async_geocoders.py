@@ -0,0 +1,19 @@
+import asyncio
+
+from shapely.geometry import Point
+
+from gis_tools.async_geocoders import AsyncGeocoder
+
+
+def test_async_here_stream(here_stub):
+    addresses = ["ул Ленина 1", "nowhere", "abc"]
+
+    async def run():
+        async with AsyncGeocoder(concurrency=2, rate_limit=100, backoff=0.01) as geo:
+            return dict([item async for item in geo.stream(addresses)])
+
+    assert asyncio.run(run()) == {0: Point(11, 1), 1: None, 2: Point(3, 1)}
+    assert len(here_stub.seen) == 6
+    # ответы уже в общем кэше
+    assert asyncio.run(run()) == {0: Point(11, 1), 1: None, 2: Point(3, 1)}
+    assert len(here_stub.seen) == 6
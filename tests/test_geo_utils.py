@@ -0,0 +1,201 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+from gis_tools import geo_utils
+from gis_tools.tile_writers import MBTilesWriter
+
+
+def make_extent():
+    return gpd.GeoSeries([box(0, 0, 10, 5)], crs=3857)
+
+
+def test_grid_over_shape_covers_bbox():
+    tiles = geo_utils.grid_over_shape(
+        make_extent(), 3857, x_delta=2, y_delta=1, filter_by_shape=False
+    )
+    assert len(tiles) == 5 * 5
+    assert tiles.crs == 3857
+    # порядок тайлов как у itertools.product(xs, ys)
+    assert tiles.iloc[0].bounds == (0, 0, 2, 1)
+    assert tiles.iloc[1].bounds == (0, 1, 2, 2)
+    assert tiles.union_all().equals(box(0, 0, 10, 5))
+
+
+def test_grid_over_shape_bounds_only():
+    bounds = geo_utils.grid_over_shape(
+        make_extent(),
+        3857,
+        x_count=5,
+        y_count=5,
+        filter_by_shape=False,
+        bounds_only=True,
+    )
+    assert isinstance(bounds, np.ndarray)
+    assert bounds.shape == (25, 4)
+    np.testing.assert_allclose(bounds[0], [0, 0, 2, 1])
+
+
+def test_grid_over_shape_filter_by_shape():
+    extents = gpd.GeoSeries(
+        [box(0, 0, 0.5, 0.5), box(0.5, 0.5, 1.5, 1.5), box(9.5, 4.5, 10, 5)], crs=3857
+    )
+    tiles = geo_utils.grid_over_shape(extents, 3857, x_delta=1, y_delta=1)
+    assert sorted(t.bounds for t in tiles) == [
+        (0, 0, 1, 1),
+        (0, 1, 1, 2),
+        (1, 0, 2, 1),
+        (1, 1, 2, 2),
+        (9, 4, 10, 5),
+    ]
+    assert tiles.index.is_unique
+
+
+def test_grid_over_shape_fill_area_filter_factor():
+    extents = gpd.GeoSeries([box(0, 0, 1.5, 1.2)], crs=3857)
+    tiles = geo_utils.grid_over_shape(
+        extents, 3857, x_delta=1, y_delta=1, fill_area_filter_factor=0.4
+    )
+    assert [t.bounds for t in tiles] == [(0, 0, 1, 1), (1, 0, 2, 1)]
+
+
+def test_tiles_over_shape_matches_mercantile():
+    mercantile = pytest.importorskip("mercantile")
+    extent = gpd.GeoSeries([box(37.3, 55.5, 37.9, 55.9)], crs=4326)
+    tiles = geo_utils.tiles_over_shape(extent, [9, 11], filter_by_shape=False)
+    expected = list(mercantile.tiles(37.3, 55.5, 37.9, 55.9, [9, 11]))
+    assert list(zip(tiles.x, tiles.y, tiles.z)) == [tuple(t) for t in expected]
+    assert list(tiles.index) == list(range(len(expected)))
+    for tile, geom in zip(expected, tiles.geometry):
+        assert geom.bounds == tuple(mercantile.bounds(tile))
+
+
+def test_tiles_over_shape_filter_by_shape():
+    # две удаленные точки: bbox огромный, а тайлов по форме - по одному на точку
+    extents = gpd.GeoSeries(
+        [box(37.60, 55.75, 37.61, 55.76), box(30.30, 59.93, 30.31, 59.94)], crs=4326
+    )
+    full = geo_utils.tiles_over_shape(extents, 12, filter_by_shape=False)
+    tiles = geo_utils.tiles_over_shape(extents, 12)
+    assert len(tiles) < len(full)
+    assert tiles.intersects(extents.union_all()).all()
+    # индексы и номера совпадают с полным bbox
+    assert (full.loc[tiles.index, ["x", "y"]].values == tiles[["x", "y"]].values).all()
+    multi = geo_utils.tiles_over_shape(extents, [10, 12])
+    assert list(multi.z.unique()) == [10, 12]
+    assert (multi[multi.z == 12][["x", "y"]].values == tiles[["x", "y"]].values).all()
+
+
+def test_geopandas_drop_duplicates():
+    gdf = gpd.GeoDataFrame(
+        {"v": [1, 2, 3, 4]},
+        geometry=[
+            box(0, 0, 1, 1),
+            box(0, 0, 1, 1),
+            box(1, 1, 2, 2),
+            box(0, 0, 1, 1.0001),
+        ],
+        crs=3857,
+    )
+    result = geo_utils.geopandas_drop_duplicates(gdf)
+    assert result["v"].tolist() == [1, 3, 4]
+    assert len(gdf) == 4
+    near = geo_utils.geopandas_drop_duplicates(gdf.geometry, tolerance=0.01)
+    assert near.index.tolist() == [0, 2]
+    assert near.crs == gdf.crs
+
+
+def test_geotiffer_streams_tiles_to_writer(tmp_path, recording_writer):
+    calls = []
+
+    def handler(bounds, fail=()):
+        calls.append(bounds[0])
+        if bounds[0] in fail:
+            raise ConnectionError(bounds)
+        return str(bounds[0]).encode() if bounds[0] else None
+
+    grid = gpd.GeoSeries([box(i, 0, i + 1, 1) for i in range(4)], crs=3857)
+    tiler = geo_utils.GeoTiffer(
+        grid,
+        handler,
+        {"fail": (2,)},
+        workers=2,
+        tiles_folder=tmp_path,
+        writer=recording_writer,
+    )
+    tiler.make_geotiff(tmp_path / "out.tif", incremental=True)
+    assert recording_writer.closed
+    assert recording_writer.tiles == {1: b"1.0", 3: b"3.0"}
+
+    # повторный запуск: готовые тайлы берутся из хранилища, скачивается только упавший
+    tiler.make_geotiff(tmp_path / "out.tif", incremental=True)
+    assert recording_writer.tiles == {1: b"1.0", 3: b"3.0"}
+    assert sorted(calls) == [0, 1, 2, 2, 3]
+
+    # без incremental временная папка задачи удаляется
+    other = tmp_path / "other"
+    tiler = geo_utils.GeoTiffer(
+        grid, handler, tiles_folder=other, writer=recording_writer
+    )
+    tiler.make_geotiff(tmp_path / "out.tif")
+    assert recording_writer.tiles == {1: b"1.0", 2: b"2.0", 3: b"3.0"}
+    assert list(other.iterdir()) == []
+
+
+def test_geotiffer_requeues_tiles_rejected_by_writer(tmp_path, recording_writer):
+    calls = []
+
+    def handler(bounds):
+        calls.append(bounds[0])
+        return str(bounds[0]).encode()
+
+    grid = gpd.GeoSeries([box(i, 0, i + 1, 1) for i in range(3)], crs=3857)
+    tiler = geo_utils.GeoTiffer(
+        grid, handler, workers=2, tiles_folder=tmp_path, writer=recording_writer
+    )
+    # тайл, который writer не принял после скачивания, не считается готовым
+    recording_writer.reject = {1}
+    tiler.make_geotiff(tmp_path / "out.tif", incremental=True)
+    assert sorted(recording_writer.tiles) == [0, 2]
+    tiler.make_geotiff(tmp_path / "out.tif", incremental=True)
+    assert sorted(recording_writer.tiles) == [0, 1, 2]
+    assert sorted(calls) == [0, 1, 1, 2]
+
+    # сохраненный тайл, который writer не принял, скачивается заново, а не роняет задачу
+    recording_writer.reject = {2}
+    tiler.make_geotiff(tmp_path / "out.tif", incremental=True)
+    assert sorted(recording_writer.tiles) == [0, 1, 2]
+    assert sorted(calls) == [0, 1, 1, 2, 2]
+
+
+def test_geotiffer_mbtiles_writer(tmp_path):
+    import sqlite3
+
+    png = b"\x89PNG\r\n\x1a\n"
+    grid = geo_utils.tiles_over_shape(
+        gpd.GeoSeries([box(37.5, 55.7, 37.7, 55.8)], crs=4326), 10
+    )
+    tiler = geo_utils.GeoTiffer(
+        grid,
+        lambda bounds: png + str(bounds).encode(),
+        workers=4,
+        tiles_folder=tmp_path,
+        writer=MBTilesWriter(metadata={"attribution": "test"}),
+    )
+    tiler.make_geotiff(tmp_path / "out.mbtiles")
+    with sqlite3.connect(tmp_path / "out.mbtiles") as conn:
+        metadata = dict(conn.execute("SELECT name, value FROM metadata"))
+        rows = conn.execute(
+            "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"
+        ).fetchall()
+    assert metadata["format"] == "png"
+    assert metadata["minzoom"] == metadata["maxzoom"] == "10"
+    assert metadata["attribution"] == "test"
+    assert len(rows) == len(grid)
+    # строки тайлов в схеме TMS
+    expected = {
+        (z, x, (1 << z) - 1 - y): png + str(geom.bounds).encode()
+        for x, y, z, geom in zip(grid.x, grid.y, grid.z, grid.geometry)
+    }
+    assert {row[:3]: row[3] for row in rows} == expected
@@ -1,7 +1,11 @@
 from shapely.geometry import Point, MultiPolygon
 import logging
 
+import pytest
+
 from gis_tools import geocoders
+from gis_tools.http_utils import HttpClient
+from gis_tools.threads_utils import AdaptiveConcurrency
 
 logger = logging.getLogger(__name__)
 
@@ -16,4 +20,80 @@ def test_rosreestr_polygon():
     logger.info(f"{geom=}, {attrs=}")
     assert attrs is not None
     assert isinstance(geom, MultiPolygon) 
-    
\ No newline at end of file
+    
+
+def test_geocode_many(here_stub):
+    addresses = ["ул Ленина 1", "nowhere", "ул  Ленина\n1", "ул Ленина, 1", "abc"]
+    result = geocoders.geocode_many(addresses, workers=4, rate_limit=100, backoff=0.01)
+    assert result == [Point(11, 1), None, Point(11, 1), Point(11, 1), Point(3, 1)]
+    # каждый уникальный адрес: один 429 и один успешный запрос
+    assert sorted(here_stub.seen) == sorted(["ул Ленина 1", "nowhere", "abc"] * 2)
+    # повторный вызов целиком из кэша, включая пустой ответ
+    assert geocoders.geocode_many(addresses) == result
+    assert len(here_stub.seen) == 6
+
+
+def test_geocode_many_error_response(here_stub):
+    addresses = ["ул Ленина 1", "unauthorized", "nowhere", "abc"]
+    result = geocoders.geocode_many(addresses, workers=4, backoff=0.01)
+    # ответ с ошибкой не роняет пакет и не кэшируется
+    assert result == [Point(11, 1), None, None, Point(3, 1)]
+    # 429, 401 и повторный 401 без обращения к кэшу
+    geocoders.geocode_many(["unauthorized"], backoff=0.01)
+    assert here_stub.seen.count("unauthorized") == 3
+
+
+def test_here_parse_malformed_response():
+    with pytest.raises(geocoders.GeocoderError):
+        geocoders._here_parse({"error": "Unauthorized"})
+    with pytest.raises(geocoders.GeocoderError):
+        geocoders._yandex_parse({"response": {}}, "ул Ленина 1")
+
+
+def test_normalize_address():
+    assert geocoders.normalize_address("ул Ленина,\t1, ул Ленина") == "ул Ленина 1"
+    assert geocoders.normalize_addresses(["a, b", "a  b", "b,,a"]) == [
+        "a b",
+        "a b",
+        "b a",
+    ]
+
+
+def test_clean_address():
+    assert geocoders.clean_address(" д. 1,\tстр. 1 ,, корп.  2, ") == (
+        "д. 1, стр. 1, корп. 2"
+    )
+    assert geocoders.normalize_addresses(
+        ["a ,b", "a, a"], geocoders.clean_address
+    ) == ["a, b", "a, a"]
+
+
+def test_here_shares_cache_between_spellings(here_stub, monkeypatch):
+    monkeypatch.setattr(geocoders, "_HTTP_CLIENT", HttpClient(backoff=0.01))
+    assert geocoders.here("ул Ленина, 1") == Point(11, 1)
+    assert geocoders.here("ул  Ленина 1", return_attrs=False) == Point(11, 1)
+    assert geocoders.geocode_many(["ул Ленина\n1"]) == [Point(11, 1)]
+    assert len(here_stub.seen) == 2
+
+
+def test_geocode_many_adaptive_workers(here_stub):
+    concurrency = AdaptiveConcurrency(max_limit=8)
+    addresses = ["ул Ленина 1", "nowhere", "abc"]
+    result = geocoders.geocode_many(addresses, workers=concurrency, backoff=0.01)
+    assert result == [Point(11, 1), None, Point(3, 1)]
+    # каждый ответ 429 уменьшает лимит
+    assert concurrency.limit < 8
+
+
+def test_http_client_default_timeout():
+    timeouts = []
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            timeouts.append(kwargs["timeout"])
+            return type("Response", (), {"status_code": 200})()
+
+    client = HttpClient(session=Session(), timeout=5)
+    client.get("http://example.com")
+    client.get("http://example.com", timeout=1)
+    assert timeouts == [5, 1]
@@ -0,0 +1,77 @@
+from shapely.geometry import Point
+
+from gis_tools import geocoders, geocoding_cache
+
+
+def test_dumps_loads():
+    for result in [None, Point(1, 2), {"title": "Москва", "position": [1, 2]}]:
+        assert geocoding_cache.loads(geocoding_cache.dumps(result)) == result
+
+
+def test_memory_cache_lru():
+    backend = geocoding_cache.MemoryCache(maxsize=2)
+    backend.set("here", "a", 1)
+    backend.set("here", "b", 2)
+    assert backend.get("here", "a") == 1
+    backend.set("here", "c", 3)
+    assert backend.get("here", "b") is None
+    assert backend.get("here", "a") == 1
+    assert backend.get("yandex", "a") is None
+
+
+def test_sqlite_cache(tmp_path):
+    backend = geocoding_cache.SqliteCache(tmp_path / "cache.sqlite")
+    backend.set("here", "a", "POINT (1 2)")
+    assert backend.get("here", "a") == "POINT (1 2)"
+    reopened = geocoding_cache.SqliteCache(tmp_path / "cache.sqlite")
+    assert reopened.get("here", "a") == "POINT (1 2)"
+    assert reopened.get("here", "b") is None
+
+
+def test_make_key_ignores_kwargs_order():
+    assert geocoding_cache.make_key("a", x=1, y=2) == geocoding_cache.make_key(
+        "a", y=2, x=1
+    )
+
+
+def test_cache_decorator(monkeypatch):
+    monkeypatch.setattr(geocoding_cache, "_BACKEND", geocoding_cache.MemoryCache())
+    calls = []
+
+    @geocoders.cache
+    def fake_geocoder(search_string):
+        calls.append(search_string)
+        return Point(1, 2)
+
+    assert fake_geocoder("Москва") == Point(1, 2)
+    assert fake_geocoder("Москва") == Point(1, 2)
+    assert calls == ["Москва"]
+
+
+def test_cache_decorator_negative_and_errors(monkeypatch):
+    monkeypatch.setattr(geocoding_cache, "_BACKEND", geocoding_cache.MemoryCache())
+    calls = []
+
+    @geocoders.cache
+    def fake_geocoder(search_string):
+        calls.append(search_string)
+        if search_string == "error":
+            raise geocoders.GeocoderError
+        return None
+
+    assert fake_geocoder("nowhere") is None
+    assert fake_geocoder("nowhere") is None
+    assert fake_geocoder("error") is None
+    assert fake_geocoder("error") is None
+    assert calls == ["nowhere", "error", "error"]
+
+
+def test_ttl(tmp_path):
+    for backend in [
+        geocoding_cache.MemoryCache(),
+        geocoding_cache.SqliteCache(tmp_path / "cache.sqlite"),
+    ]:
+        backend.set("here", "old", b"N", ttl=-1)
+        backend.set("here", "new", b"N", ttl=60)
+        assert backend.get("here", "old") is None
+        assert backend.get("here", "new") == b"N"
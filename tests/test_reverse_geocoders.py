@@ -0,0 +1,234 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import MultiPoint, Point, box
+
+from gis_tools import geocoding_cache, reverse_geocoders
+
+
+@pytest.fixture
+def layers(monkeypatch):
+    regions = gpd.GeoDataFrame(
+        {"name": ["Московская область", "Москва"]},
+        geometry=[box(35, 54, 40, 57), box(37, 55, 38, 56)],
+        crs=4326,
+    )
+    cities = gpd.GeoDataFrame(
+        {
+            "Город": ["Москва", "Нижний Новгород", "Тверь"],
+            "Регион": ["Москва", "Нижегородская область", "Тверская область"],
+            "Регион_re": ["москва", "нижегородская обл", "тверская обл"],
+        },
+        geometry=[box(37, 55, 38, 56), box(43, 56, 44, 57), box(35, 56, 36, 57)],
+        crs=4326,
+    )
+    registry = reverse_geocoders.make_layers_registry()
+    registry.register("regions", lambda: regions)
+    registry.register("cities", lambda: cities)
+    monkeypatch.setattr(reverse_geocoders, "LAYERS", registry)
+    return regions, cities
+
+
+def test_extract_region_by_point(layers):
+    # точка лежит в обоих полигонах - берется первый по порядку слоя
+    assert reverse_geocoders.extract_region_by_point(Point(37.5, 55.5)) == (
+        "Московская область"
+    )
+    assert reverse_geocoders.extract_region_by_point(Point(0, 0)) is None
+    assert reverse_geocoders.extract_city_by_point(
+        MultiPoint([(37.1, 55.1), (37.2, 55.2)])
+    ) == ("Москва")
+    with pytest.raises(TypeError):
+        reverse_geocoders.extract_region_by_point(box(0, 0, 1, 1))
+
+
+def test_extract_by_points(layers):
+    points = [Point(37.5, 55.5), Point(0, 0), Point(43.5, 56.5)]
+    assert reverse_geocoders.extract_city_by_points(points).tolist() == [
+        "Москва",
+        None,
+        "Нижний Новгород",
+    ]
+    assert reverse_geocoders.extract_region_by_points([]).tolist() == []
+    assert reverse_geocoders.extract_city_by_points(np.empty((0, 2))).dtype == object
+    coords = np.array([[36, 55], [37.5, 55.5], [50, 50]])
+    assert reverse_geocoders.extract_region_by_points(coords).tolist() == [
+        "Московская область",
+        "Московская область",
+        None,
+    ]
+
+
+def test_extract_by_address(layers):
+    matcher = reverse_geocoders.AddressMatcher(layers[1])
+    assert matcher.city("г. нижний новгород, ул. Ленина") == ("Нижний новгород")
+    assert matcher.city("Тверская 5, Москвабад") is None
+    assert matcher.region("Тверская обл, г. Москва") == "Тверская область"
+    assert matcher.region("г. Нижний Новгород") == "Нижегородская область"
+    assert matcher.region(None) is None
+
+
+def test_extract_by_addresses(layers):
+    addresses = gpd.pd.Series(
+        ["Москва, Тверская 1", None, "Тверь", "Москва, Тверская 1"], index=[5, 6, 7, 8]
+    )
+    cities = reverse_geocoders.extract_cities_by_addresses(addresses)
+    assert cities.to_dict() == {5: "Москва", 6: None, 7: "Тверь", 8: "Москва"}
+    regions = reverse_geocoders.extract_regions_by_addresses(addresses)
+    assert regions.tolist() == ["Москва", None, "Тверская область", "Москва"]
+    assert reverse_geocoders.extract_city_by_address("тверь") == "Тверь"
+
+
+def test_geometry_by_name(layers):
+    regions, cities = layers
+    assert reverse_geocoders.get_city_geometry(" тверь ") == cities.geometry.iloc[2]
+    assert reverse_geocoders.get_region_geometry("Атлантида") is None
+    result = reverse_geocoders.get_cities_geometries(
+        gpd.pd.Series(["МОСКВА", "Атлантида", None], index=[3, 2, 1])
+    )
+    assert result.index.tolist() == [3, 2, 1]
+    assert result.crs == cities.crs
+    assert result.iloc[0] == cities.geometry.iloc[0]
+    assert result.iloc[1:].isna().all()
+
+
+def test_layers_snapshot(layers, tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    regions, _ = layers
+    gpkg_path = tmp_path / "Russia_boundaries.gpkg"
+    regions.to_file(gpkg_path, layer="regions")
+    monkeypatch.setattr(reverse_geocoders, "RUSSIA_REGIONS_PATH", gpkg_path)
+    monkeypatch.setattr(reverse_geocoders, "RUSSIA_SNAPSHOT_FOLDER", tmp_path / "snap")
+    monkeypatch.setattr(reverse_geocoders, "USE_LAYERS_SNAPSHOT", True)
+
+    first = reverse_geocoders._read_layer("regions")
+    assert (tmp_path / "snap" / "regions.parquet").exists()
+    read_file = gpd.read_file
+    monkeypatch.setattr(gpd, "read_file", None)
+    second = reverse_geocoders._read_layer("regions")
+    assert second.geometry.equals(first.geometry)
+    assert second["name"].tolist() == first["name"].tolist()
+
+    # изменение gpkg инвалидирует копию
+    monkeypatch.setattr(gpd, "read_file", read_file)
+    regions.iloc[:1].to_file(gpkg_path, layer="regions", mode="w")
+    assert len(reverse_geocoders._read_layer("regions")) == 1
+
+    # поврежденная копия читается заново из gpkg
+    (tmp_path / "snap" / "regions.parquet").write_bytes(b"PAR1 broken")
+    assert len(reverse_geocoders._read_layer("regions")) == 1
+    assert len(reverse_geocoders._read_snapshot("regions")) == 1
+
+
+def test_layers_snapshot_write_error(layers, tmp_path, monkeypatch, caplog):
+    pytest.importorskip("pyarrow")
+    regions, _ = layers
+    gpkg_path = tmp_path / "Russia_boundaries.gpkg"
+    regions.to_file(gpkg_path, layer="regions")
+    # папка копии недоступна для записи: путь занят файлом
+    (tmp_path / "snap").write_text("")
+    monkeypatch.setattr(reverse_geocoders, "RUSSIA_REGIONS_PATH", gpkg_path)
+    monkeypatch.setattr(reverse_geocoders, "RUSSIA_SNAPSHOT_FOLDER", tmp_path / "snap")
+    monkeypatch.setattr(reverse_geocoders, "USE_LAYERS_SNAPSHOT", True)
+    monkeypatch.setattr(reverse_geocoders, "_SNAPSHOT_WRITE_WARNED", False)
+    with caplog.at_level("DEBUG", logger=reverse_geocoders.__name__):
+        assert len(reverse_geocoders._read_layer("regions")) == 2
+        assert len(reverse_geocoders._read_layer("regions")) == 2
+    warnings = [r for r in caplog.records if r.levelname == "WARNING"]
+    assert len(warnings) == 1
+
+
+def test_layer_registry_loads_once():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return gpd.GeoDataFrame(geometry=[box(0, 0, 1, 1)], crs=4326)
+
+    registry = reverse_geocoders.LayerRegistry()
+    registry.register("layer", factory)
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        results = list(executor.map(lambda _: registry.get("layer"), range(50)))
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    stats = registry.stats()["layer"]
+    assert stats["load_time"] >= 0.05
+    assert stats["memory"] > 0
+
+
+class RevgeocodeHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        lat, lng = parse_qs(urlparse(self.path).query)["at"][0].split(",")
+        self.requests.append((lat, lng))
+        items = []
+        if float(lat) < 60:
+            items = [
+                {"distance": 10, "address": {"label": f"far {lat},{lng}"}},
+                {"distance": 1, "address": {"label": f"{lat},{lng}"}},
+            ]
+        body = json.dumps({"items": items}).encode()
+        status = 200
+        # ответ с ошибкой вместо items
+        if float(lat) >= 80:
+            status = 401
+            body = json.dumps({"error": "Unauthorized"}).encode()
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_reverse_geocode_many(layers, monkeypatch, stub_server):
+    RevgeocodeHandler.requests = []
+    url = stub_server(RevgeocodeHandler)
+    monkeypatch.setenv("HERE_API_KEY", "test")
+    monkeypatch.setattr(reverse_geocoders, "HERE_REVGEOCODE_URL", url + "/")
+    monkeypatch.setattr(geocoding_cache, "_BACKEND", geocoding_cache.MemoryCache())
+    points = [
+        Point(37.500001, 55.500001),
+        Point(37.5, 55.5),
+        Point(0, 70),
+        Point(43.5, 56.5),
+    ]
+    result = list(reverse_geocoders.reverse_geocode_many(points, chunk_size=3))
+    again = list(reverse_geocoders.reverse_geocode_many(points))
+    precise = list(reverse_geocoders.reverse_geocode_many(points[:2], precision=7))
+    assert result == [
+        {"region": "Московская область", "city": "Москва", "address": "55.5,37.5"},
+        {"region": "Московская область", "city": "Москва", "address": "55.5,37.5"},
+        {"region": None, "city": None, "address": None},
+        {"region": None, "city": "Нижний Новгород", "address": "56.5,43.5"},
+    ]
+    assert again == result
+    # ключ кэша строится с той же точностью, что и запрос
+    assert [r["address"] for r in precise] == ["55.500001,37.500001", "55.5,37.5"]
+    assert sorted(RevgeocodeHandler.requests) == [
+        ("55.5", "37.5"),
+        ("55.500001", "37.500001"),
+        ("56.5", "43.5"),
+        ("70.0", "0.0"),
+    ]
+
+
+def test_reverse_geocode_many_error_response(layers, monkeypatch, stub_server):
+    RevgeocodeHandler.requests = []
+    url = stub_server(RevgeocodeHandler)
+    monkeypatch.setenv("HERE_API_KEY", "test")
+    monkeypatch.setattr(reverse_geocoders, "HERE_REVGEOCODE_URL", url + "/")
+    monkeypatch.setattr(geocoding_cache, "_BACKEND", geocoding_cache.MemoryCache())
+    points = [Point(37.5, 55.5), Point(0, 85), Point(43.5, 56.5)]
+    result = list(reverse_geocoders.reverse_geocode_many(points, chunk_size=1))
+    assert [r["address"] for r in result] == ["55.5,37.5", None, "56.5,43.5"]
+    with pytest.raises(reverse_geocoders.GeocoderError):
+        reverse_geocoders._here_revgeocode_parse({"error": "Unauthorized"})
@@ -0,0 +1,262 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from gis_tools import threads_utils
+
+
+def slow_square(x):
+    time.sleep(0.001 * (x % 5))
+    return x * x
+
+
+def test_pool_execute():
+    assert sorted(threads_utils.pool_execute(slow_square, range(20), workers=4)) == [
+        x * x for x in range(20)
+    ]
+    assert threads_utils.pool_execute(pow, [(2, 3), {"base": 3, "exp": 2}]) in (
+        [8, 9],
+        [9, 8],
+    )
+
+
+def test_pool_iter_ordered_and_bounded():
+    in_flight = []
+    lock = threading.Lock()
+    active = [0]
+
+    def work(x):
+        with lock:
+            active[0] += 1
+            in_flight.append(active[0])
+        time.sleep(0.002)
+        with lock:
+            active[0] -= 1
+        return x
+
+    # бесконечный вход: читается лениво
+    results = threads_utils.pool_iter(
+        work, itertools.count(), workers=8, max_in_flight=3
+    )
+    assert list(itertools.islice(results, 50)) == list(range(50))
+    results.close()
+    assert max(in_flight) <= 3
+
+
+def test_pool_iter_checkpoint(tmp_path):
+    checkpoint = tmp_path / "progress.txt"
+    calls = []
+
+    def work(x):
+        calls.append(x)
+        if x == 7:
+            raise ValueError(x)
+        return x
+
+    with pytest.raises(ValueError):
+        for _ in threads_utils.pool_iter(
+            work, range(10), workers=1, max_in_flight=1, checkpoint=checkpoint
+        ):
+            pass
+    assert calls == list(range(8))
+
+    calls.clear()
+    resumed = threads_utils.pool_iter(
+        lambda x: calls.append(x) or x, range(10), workers=2, checkpoint=checkpoint
+    )
+    assert list(resumed) == [7, 8, 9]
+    assert sorted(calls) == [7, 8, 9]
+
+
+def fail_on_odd(x):
+    if x % 2:
+        raise ValueError(x)
+    return x
+
+
+def test_pool_execute_error_policies():
+    result = threads_utils.pool_execute(
+        fail_on_odd, range(6), workers=3, errors="collect"
+    )
+    assert sorted(result) == [0, 2, 4]
+    assert sorted(result.errors) == [1, 3, 5]
+    assert isinstance(result.errors[3].exception, ValueError)
+    assert result.errors[3].args == 3
+
+    assert sorted(threads_utils.pool_execute(fail_on_odd, range(6), errors="skip")) == [
+        0,
+        2,
+        4,
+    ]
+
+    with pytest.raises(ValueError) as exc_info:
+        threads_utils.pool_execute(fail_on_odd, [0, 2, 1], workers=1)
+    assert sorted(exc_info.value.partial_results) == [0, 2]
+
+
+def test_pool_execute_retries():
+    attempts = []
+
+    def flaky(x):
+        attempts.append(x)
+        if attempts.count(x) < 3:
+            raise ConnectionError(x)
+        return x
+
+    assert threads_utils.pool_execute(flaky, [1], retries=2, backoff=0) == [1]
+    assert attempts == [1, 1, 1]
+
+
+def test_loop_execute_error_policies():
+    assert threads_utils.loop_execute(fail_on_odd, [0, 2, 3, 4]) == [0, 2]
+    result = threads_utils.loop_execute(fail_on_odd, [0, 1, 2], errors="collect")
+    assert result == [0, 2]
+    assert list(result.errors) == [1]
+
+
+WORKER_STATE = {}
+
+
+def init_worker(value):
+    WORKER_STATE["value"] = value
+
+
+def add_state(x):
+    return x + WORKER_STATE["value"]
+
+
+@pytest.mark.parametrize("chunksize", [7, "auto"])
+def test_pool_iter_chunks_in_processes(chunksize):
+    results = threads_utils.pool_iter(
+        add_state,
+        range(100),
+        workers=2,
+        pool_type="process",
+        chunksize=chunksize,
+        initializer=init_worker,
+        initargs=(1000,),
+    )
+    assert list(results) == list(range(1000, 1100))
+
+
+def test_pool_iter_chunks_error_policy():
+    results = list(
+        threads_utils.pool_iter(
+            fail_on_odd, range(10), workers=2, chunksize=4, errors="collect"
+        )
+    )
+    assert [r for r in results if not isinstance(r, threads_utils.TaskError)] == [
+        0,
+        2,
+        4,
+        6,
+        8,
+    ]
+    assert [r.index for r in results if isinstance(r, threads_utils.TaskError)] == [
+        1,
+        3,
+        5,
+        7,
+        9,
+    ]
+
+
+def test_auto_chunk_size():
+    size = threads_utils.AutoChunkSize(target=0.1, max_size=500)
+    size.update(elapsed=0.01, count=10)
+    assert size.size == 100
+    size.update(elapsed=0, count=10)
+    assert size.size == 500
+    size.update(elapsed=10, count=1)
+    assert size.size == 1
+
+
+def test_pool_execute_progress():
+    reports = []
+    result = threads_utils.pool_execute(
+        fail_on_odd,
+        range(10),
+        workers=2,
+        errors="skip",
+        progress=reports.append,
+        progress_interval=0,
+    )
+    assert sorted(result) == [0, 2, 4, 6, 8]
+    # отчет на каждый результат и финальный
+    assert len(reports) == 11
+    stats = reports[-1]
+    assert (stats.done, stats.errors, stats.in_flight, stats.total) == (5, 5, 0, 10)
+    assert stats.error_rate == 0.5
+    assert stats.eta == 0
+    assert stats.latency[50] <= stats.latency[99]
+    assert "Done 10 out 10" in str(stats)
+
+
+def test_loop_execute_progress_throttled():
+    monitor = threads_utils.ProgressMonitor(interval=3600)
+    results = threads_utils.loop_execute(slow_square, range(5), progress=monitor)
+    assert results == [0, 1, 4, 9, 16]
+    stats = monitor.stats()
+    assert stats.done == 5 and stats.in_flight == 0
+    assert stats.throughput > 0
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def test_adaptive_concurrency_aimd():
+    concurrency = threads_utils.AdaptiveConcurrency(max_limit=50, initial=4)
+    for _ in range(10):
+        concurrency.update(0.01)
+    # slow start: +1 на каждую успешную задачу
+    assert concurrency.limit == 14
+    concurrency.update(0.01, is_ok=False, exception=Throttled())
+    assert concurrency.limit == 7
+    # после снижения сигналы игнорируются, пока не завершатся limit задач
+    concurrency.throttled()
+    assert concurrency.limit == 7
+    for _ in range(7):
+        concurrency.update(0.01)
+    assert concurrency.limit == 7
+    concurrency.throttled()
+    assert concurrency.limit == 3
+    # рост задержки тоже считается перегрузкой
+    for _ in range(30):
+        concurrency.update(0.01)
+    limit = concurrency.limit
+    for _ in range(5):
+        concurrency.update(1.0)
+    assert concurrency.limit < limit
+
+
+def test_pool_iter_adaptive_workers():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def limited(x):
+        # сервер отвечает 429, если одновременно больше 3 запросов
+        with lock:
+            running.append(x)
+            peak.append(len(running))
+            overloaded = len(running) > 3
+        time.sleep(0.005)
+        with lock:
+            running.remove(x)
+        if overloaded:
+            raise Throttled(x)
+        return x
+
+    concurrency = threads_utils.AdaptiveConcurrency(max_limit=20)
+    results = list(
+        threads_utils.pool_iter(
+            limited, range(300), workers=concurrency, errors="collect"
+        )
+    )
+    assert len(results) == 300
+    errors = [r for r in results if isinstance(r, threads_utils.TaskError)]
+    assert len(errors) < 100
+    assert concurrency.limit <= 10
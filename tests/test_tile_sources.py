@@ -0,0 +1,152 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+from gis_tools import geo_utils
+from gis_tools.http_utils import HostRateLimiter
+from gis_tools.tile_sources import WMSSource, XYZSource
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+class TileStubHandler(BaseHTTPRequestHandler):
+    """XYZ-сервер тайлов: на каждый новый тайл сначала отвечает 429, тайлов с нечетным x нет.
+    /static/... отвечает без 429
+    """
+
+    seen = []
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        first = path not in self.seen
+        self.seen.append(path)
+        if path.startswith("/static/"):
+            path = path.removeprefix("/static")
+        elif first:
+            self.send_response(429)
+            self.end_headers()
+            return
+        z, x, y = path.strip("/").removesuffix(".png").split("/")
+        if int(x) % 2:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = PNG + path.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server(stub_server):
+    TileStubHandler.seen = []
+    return stub_server(TileStubHandler)
+
+
+def make_grid():
+    return geo_utils.tiles_over_shape(
+        gpd.GeoSeries([box(37.5, 55.7, 37.7, 55.8)], crs=4326), 11
+    )
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_geotiffer_xyz_source(tile_server, tmp_path, recording_writer, asynchronous):
+    grid = make_grid()
+    source = XYZSource(tile_server + "/{z}/{x}/{y}.png", asynchronous=asynchronous)
+    tiler = geo_utils.GeoTiffer(
+        grid,
+        source,
+        workers=4,
+        tiles_folder=tmp_path,
+        writer=recording_writer,
+        backoff=0.01,
+    )
+    tiler.make_geotiff(tmp_path / "out")
+    expected = {
+        i: PNG + f"/{z}/{x}/{y}.png".encode()
+        for i, x, y, z in zip(grid.index, grid.x, grid.y, grid.z)
+        if x % 2 == 0
+    }
+    assert expected and recording_writer.tiles == expected
+    # каждый тайл: один 429 и один успешный запрос
+    assert len(TileStubHandler.seen) == 2 * len(grid)
+
+
+def test_geotiffer_async_handler_gets_shared_session(
+    tile_server, tmp_path, recording_writer
+):
+    sessions = set()
+
+    async def handler(bounds, session, suffix=".png"):
+        sessions.add(id(session))
+        async with session.get(f"{tile_server}/static/1/0/0{suffix}") as r:
+            return await r.read() if r.status == 200 else None
+
+    grid = make_grid()
+    tiler = geo_utils.GeoTiffer(
+        grid,
+        handler,
+        {"suffix": ".png"},
+        workers=4,
+        writer=recording_writer,
+        retries=1,
+        backoff=0,
+    )
+    tiler.make_geotiff(tmp_path / "out")
+    assert set(recording_writer.tiles.values()) == {PNG + b"/1/0/0.png"}
+    assert len(recording_writer.tiles) == len(grid)
+    assert len(sessions) == 1
+
+
+def test_geotiffer_handler_session_goes_through_client(
+    tile_server, tmp_path, recording_writer
+):
+    def handler(bounds, session):
+        x, y = round(bounds[0] * 1e4), round(bounds[1] * 1e4)
+        r = session.get(f"{tile_server}/1/{2 * x}/{y}.png")
+        return r.content if r.status_code == 200 else None
+
+    grid = make_grid().head(3)
+    tiler = geo_utils.GeoTiffer(
+        grid, handler, workers=2, writer=recording_writer, rate_limit=100, backoff=0.01
+    )
+    tiler.make_geotiff(tmp_path / "out")
+    # ответы 429 повторяет HttpClient, а не функция
+    assert len(recording_writer.tiles) == len(grid)
+    assert len(TileStubHandler.seen) == 2 * len(grid)
+
+
+def test_wms_source_url():
+    source = WMSSource("http://example.com/wms?map=a", "roads", crs="EPSG:4326")
+    query = parse_qs(urlparse(source.url((37.0, 55.0, 38.0, 56.0), {})).query)
+    assert query["map"] == ["a"]
+    assert query["REQUEST"] == ["GetMap"]
+    assert query["CRS"] == ["EPSG:4326"]
+    # WMS 1.3.0 и EPSG:4326: широта, долгота
+    assert query["BBOX"] == ["55.0,37.0,56.0,38.0"]
+    source = WMSSource("http://example.com/wms", "roads", version="1.1.1")
+    query = parse_qs(urlparse(source.url((1, 2, 3, 4), {})).query)
+    assert query["SRS"] == ["EPSG:3857"]
+    assert query["BBOX"] == ["1,2,3,4"]
+
+
+def test_xyz_source_url():
+    source = XYZSource("https://{s}.tiles.test/{z}/{x}/{-y}.png", subdomains="ab")
+    assert (
+        source.url(None, {"x": 3, "y": 0, "z": 2}) == "https://b.tiles.test/2/3/3.png"
+    )
+
+
+def test_host_rate_limiter():
+    limiter = HostRateLimiter(1)
+    a = limiter.for_url("http://a.test/1")
+    assert limiter.for_url("http://a.test/2") is a
+    assert limiter.for_url("http://b.test/1") is not a
@@ -0,0 +1,84 @@
+import threading
+import time
+from functools import partial
+
+import pytest
+from shapely.geometry import box
+
+from gis_tools import tile_store
+from gis_tools.tile_store import TileStore, tile_key
+
+
+def handler(bounds, layer="a"):
+    return b"tile"
+
+
+def test_handler_key():
+    assert tile_store.handler_key(handler) == tile_store.handler_key(handler, {})
+    assert tile_store.handler_key(handler, {"layer": "a"}) != tile_store.handler_key(
+        handler, {"layer": "b"}
+    )
+
+
+def make_handler(layer):
+    def fetch(bounds):
+        return layer.encode()
+
+    return fetch
+
+
+def test_handler_key_distinguishes_callables():
+    key = tile_store.handler_key
+    assert key(partial(handler, layer="a")) != key(partial(handler, layer="b"))
+    assert key(partial(handler, layer="a")) == key(partial(handler, layer="a"))
+    assert key(make_handler("a")) != key(make_handler("b"))
+    assert key(make_handler("a")) == key(make_handler("a"))
+    assert key(lambda bounds: b"a") != key(lambda bounds: b"b")
+
+
+def test_handler_key_ignores_mutable_closure_state():
+    calls = []
+
+    def fetch(bounds):
+        calls.append(bounds)
+        return b"tile"
+
+    key = tile_store.handler_key(fetch)
+    calls.append(1)
+    assert tile_store.handler_key(fetch) == key
+
+
+def test_handler_key_unstable_state():
+    with pytest.raises(tile_store.UnstableHandlerError):
+        tile_store.handler_key(partial(handler, layer=threading.Lock()))
+
+
+def test_tile_store_incremental(tmp_path):
+    grid = [(0, box(0, 0, 1, 1)), (1, box(1, 0, 2, 1)), (2, box(2, 0, 3, 1))]
+    store = TileStore(tmp_path)
+    assert store.split(grid) == ([], grid)
+    store.put(tile_key(grid[0][1].bounds), 0, b"png")
+    store.put(tile_key(grid[1][1].bounds), 1, None)
+    store.fail(tile_key(grid[2][1].bounds), 2, ConnectionError("timeout"))
+    assert store.path(tile_key(grid[0][1].bounds)).read_bytes() == b"png"
+    store.close()
+
+    # после перезапуска и расширения сетки скачиваются только упавший и новый тайлы
+    store = TileStore(tmp_path)
+    extended = [(i + 1, geom) for i, geom in grid] + [(0, box(-1, 0, 0, 1))]
+    done, missing = store.split(extended)
+    assert [i for i, _ in done] == [1]
+    assert [i for i, _ in missing] == [3, 0]
+    keys = [tile_key(geom.bounds) for _, geom in extended]
+    assert store.report(keys) == {"done": 1, "empty": 1, "failed": 1, "missing": 1}
+    store.close()
+
+
+def test_tile_store_max_age(tmp_path):
+    grid = [(0, box(0, 0, 1, 1))]
+    store = TileStore(tmp_path, max_age=0.05)
+    store.put(tile_key(grid[0][1].bounds), 0, b"png")
+    assert store.split(grid) == (grid, [])
+    time.sleep(0.1)
+    assert store.split(grid) == ([], grid)
+    store.close()
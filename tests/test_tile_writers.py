@@ -0,0 +1,58 @@
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+from gis_tools.tile_writers import COGWriter, GeoTiffWriter, WindowedGeoTiffWriter
+
+gdal = pytest.importorskip("osgeo.gdal")
+
+TILE_SIZE = 16
+
+
+def write_mosaic(writer, tmp_path, output_name):
+    """Записывает мозаику 2x2 тайла 16x16 пикселей на экстенте (0, 0, 2, 2)"""
+    grid = gpd.GeoDataFrame(
+        geometry=[box(x, y, x + 1, y + 1) for x in (0, 1) for y in (0, 1)], crs=3857
+    )
+    output_path = tmp_path / output_name
+    writer.open(output_path, grid)
+    for tile_index, tile_geom in grid.geometry.items():
+        tile_path = tmp_path / f"tile_{tile_index}.tif"
+        ds = gdal.GetDriverByName("GTiff").Create(
+            str(tile_path), TILE_SIZE, TILE_SIZE, 3, gdal.GDT_Byte
+        )
+        for band in range(1, 4):
+            ds.GetRasterBand(band).Fill(50 * (tile_index + 1))
+        ds = None
+        writer.write(tile_index, tile_geom, tile_path)
+    writer.close()
+    return gdal.Open(str(output_path))
+
+
+def assert_mosaic_extent(ds):
+    assert (ds.RasterXSize, ds.RasterYSize) == (2 * TILE_SIZE, 2 * TILE_SIZE)
+    assert ds.RasterCount == 3
+    x0, xres, _, y1, _, yres = ds.GetGeoTransform()
+    bounds = (x0, y1 + yres * ds.RasterYSize, x0 + xres * ds.RasterXSize, y1)
+    assert bounds == pytest.approx((0, 0, 2, 2))
+
+
+def test_geotiff_writer(tmp_path):
+    ds = write_mosaic(GeoTiffWriter(), tmp_path, "out.tif")
+    assert ds.GetDriver().ShortName == "GTiff"
+    assert_mosaic_extent(ds)
+
+
+def test_windowed_geotiff_writer(tmp_path):
+    ds = write_mosaic(WindowedGeoTiffWriter(), tmp_path, "out.tif")
+    assert_mosaic_extent(ds)
+    # тайлы без потерь записаны в свои окна: (0, 0, 1, 1) - нижний левый
+    data = ds.GetRasterBand(1).ReadAsArray()
+    assert data[TILE_SIZE:, :TILE_SIZE].tolist() == [[50] * TILE_SIZE] * TILE_SIZE
+    assert data[:TILE_SIZE, TILE_SIZE:].tolist() == [[200] * TILE_SIZE] * TILE_SIZE
+
+
+def test_cog_writer(tmp_path):
+    ds = write_mosaic(COGWriter(), tmp_path, "out.tif")
+    assert_mosaic_extent(ds)
+    assert ds.GetMetadataItem("LAYOUT", "IMAGE_STRUCTURE") == "COG"